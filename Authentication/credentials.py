@@ -43,11 +43,163 @@ KNOX_CLIENT_SECRET = credentials['KNOX_CLIENT_SECRET']
 
 # [OpenAI Server] ChatGPT Credentials
 OPENAI_API_KEY = credentials['OPENAI_API_KEY']
-OPENAI_COMPLETION_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_BASE_URL = "https://api.openai.com/v1"
 OPENAI_MODEL = "gpt-4o"
+OPENAI_SMALL_MODEL = "gpt-4o-mini"
 OPENAI_TEMPERATURE = 0.7
+# stream answers as server-sent events and show them in Webex while they are generated
+OPENAI_STREAM = True
+
+# [NetworkGPT] LLM backend: "openai" for the OpenAI API, "local" for an on-prem OpenAI-compatible server (e.g. vLLM or
+# Ollama), or "stub" for the bundled deterministic stub server, started with the bot for offline runs and benchmarks.
+# The auth scheme is "bearer", "api-key" (api-key header) or "none". A backend "model" is used for every stage instead of
+# OPENAI_STAGE_MODELS, and only rate-limited backends go through the rate-limit governor.
+LLM_BACKEND = credentials.get('LLM_BACKEND') or "openai"
+# port and fixed response latency in seconds of the stub server
+LLM_STUB_PORT = 8765
+LLM_STUB_LATENCY = 0.2
+LLM_BACKENDS = {
+    "openai": {
+        "base_url": OPENAI_BASE_URL,
+        "auth": "bearer",
+        "api_key": OPENAI_API_KEY,
+        "model": None,
+        "rate_limited": True
+    },
+    "local": {
+        "base_url": credentials.get('LOCAL_LLM_BASE_URL') or "http://localhost:8000/v1",
+        "auth": credentials.get('LOCAL_LLM_AUTH') or "none",
+        "api_key": credentials.get('LOCAL_LLM_API_KEY'),
+        "model": credentials.get('LOCAL_LLM_MODEL') or "llama3.1",
+        "rate_limited": False
+    },
+    "stub": {
+        "base_url": f"http://127.0.0.1:{LLM_STUB_PORT}/v1",
+        "auth": "none",
+        "api_key": None,
+        "model": "networkgpt-stub",
+        "rate_limited": False
+    }
+}
+
+# [NetworkGPT] Model per pipeline stage, stages without an entry use OPENAI_MODEL. Grounded answers over CI of at most
+# SMALL_ANSWER_CI_TOKENS use the "small_answer" stage. Per-stage latency and tokens are reported by /stats.
+OPENAI_STAGE_MODELS = {
+    "intent": OPENAI_SMALL_MODEL,
+    "chit_chat": OPENAI_SMALL_MODEL,
+    "small_answer": OPENAI_SMALL_MODEL,
+    "answer": OPENAI_MODEL,
+    "tools": OPENAI_MODEL,
+    "extract": OPENAI_SMALL_MODEL,
+    "merge": OPENAI_MODEL,
+    "summary": OPENAI_SMALL_MODEL
+}
+SMALL_ANSWER_CI_TOKENS = 1500
+
+# [NetworkGPT] OpenAI client, connections are pooled and kept alive, transient failures (429/5xx) are retried with
+# jittered exponential backoff. Timeouts are in seconds, the read timeout applies between two streamed chunks.
+LLM_POOL_MAXSIZE = 16
+LLM_WARM_CONNECTIONS = 2
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 60
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8
+
+# [NetworkGPT] Hedged requests, a streamed request without a response after the LLM_HEDGE_PERCENTILE percentile of
+# recent latency is sent a second time, the first response is kept and the other stream is closed. Single responses
+# cannot be abandoned once sent and are never hedged. 0 disables hedging. At most
+# LLM_HEDGE_BUDGET_PER_MINUTE hedges are sent per minute, and only once LLM_HEDGE_MIN_SAMPLES latencies are known.
+LLM_HEDGE_PERCENTILE = 95
+LLM_HEDGE_BUDGET_PER_MINUTE = 10
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_WINDOW = 200
+
+# [NetworkGPT] Rate limits per model as (requests per minute, tokens per minute), corrected from OpenAI's rate-limit
+# headers. Requests over the limits wait in a queue served round-robin across rooms, for at most RATE_LIMIT_MAX_WAIT
+# seconds. Each request is counted as its prompt plus RATE_LIMIT_COMPLETION_TOKENS until its actual usage is known.
+OPENAI_RATE_LIMITS = {
+    "default": (500, 30000),
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000)
+}
+RATE_LIMIT_MAX_WAIT = 120
+RATE_LIMIT_COMPLETION_TOKENS = 500
+
+# [NetworkGPT] Local intent classifier, questions below these thresholds fall back to ChatGPT
+INTENT_CLASSIFIER_MIN_SCORE = 0.4
+INTENT_CLASSIFIER_MIN_MARGIN = 0.12
+# questions kept in the intent history log, the log is rotated once when it reaches this many lines
+INTENT_HISTORY_MAX_ENTRIES = 5000
+
+# [NetworkGPT] Estimated token budget of the controller information (ci) sent with a question
+CI_TOKEN_BUDGET = 8000
+
+# [NetworkGPT] Answer mode of intents with KB tools: "ci" sends the intent's CI with the question, "tools" lets ChatGPT
+# call functions returning only the KB records it needs, over at most KB_TOOL_MAX_ROUNDS rounds
+ANSWER_MODE = "ci"
+KB_TOOL_MAX_ROUNDS = 4
+
+# [NetworkGPT] Number of records retrieved from the BM25 index when an intent's CI does not fit the token budget, 0 to
+# rank the whole CI of the intent instead
+CI_RETRIEVAL_TOP_K = 25
+
+# [NetworkGPT] Local KB queries, counting and lookup questions over one KB section are answered without ChatGPT, listing
+# at most LOCAL_QUERY_MAX_ROWS records
+LOCAL_QUERY_ENABLED = True
+LOCAL_QUERY_MAX_ROWS = 25
+
+# [NetworkGPT] Map-reduce answers for CI over MAP_REDUCE_MIN_TOKENS, 0 to disable: the CI is split into chunks of
+# MAP_REDUCE_CHUNK_TOKENS summarised concurrently, then merged in a final ChatGPT call. Only used when the records the
+# question matches do not fit CI_TOKEN_BUDGET, as it costs one request per chunk plus the merge. CI needing more than
+# MAP_REDUCE_MAX_CHUNKS chunks is cut down to the token budget instead. Opt-in, e.g. 20000
+MAP_REDUCE_MIN_TOKENS = 0
+MAP_REDUCE_CHUNK_TOKENS = 8000
+MAP_REDUCE_MAX_CHUNKS = 16
+MAP_REDUCE_MAX_WORKERS = 8
+MAP_REDUCE_CACHE_MAX_ENTRIES = 1024
+
+# [NetworkGPT] Speculation while the ChatGPT intent request is in flight: CI is prepared for the top local classifier
+# candidates, and optionally the answer for the top candidate is started and cancelled if ChatGPT picks another intent
+SPECULATIVE_CI_CANDIDATES = 2
+SPECULATIVE_ANSWER = False
+SPECULATIVE_ANSWER_MIN_SCORE = 0.25
+
+# [NetworkGPT] Intent cache, keyed on the normalised question with entities masked
+INTENT_CACHE_MAX_ENTRIES = 1000
+INTENT_CACHE_TTL = 86400
+
+# [NetworkGPT] Answer cache, entries are dropped as soon as the KB sections they were answered from change
+ANSWER_CACHE_MAX_ENTRIES = 500
+ANSWER_CACHE_TTL = 86400
+# seconds between writes of a changed intent or answer cache to disk, changes are also written at shutdown
+CACHE_FLUSH_INTERVAL = 10
+
+# [NetworkGPT] Start-up, when enabled the Webex bot, prompt workbook and controllers are set up in parallel and the
+# OpenAI connection warm-up runs in the background, so the bot answers from the persisted KB straight away
+FAST_STARTUP = True
+
+# [NetworkGPT] Knowledge base refresh, when enabled the controllers are polled in a background thread and their KB
+# files regenerated every 15 minutes. Off by default, the bot then serves the persisted KB files as they are
+KB_REFRESH_ENABLED = False
+
+# [NetworkGPT] Request handling, rooms are answered concurrently and each room keeps its own conversation context
+CHATBOT_MAX_WORKERS = 8
+CHATBOT_MAX_PENDING = 64
+CONVERSATION_IDLE_TIMEOUT = 3600
+# estimated tokens of past turns sent with each question, older turns are folded into a summary of at most
+# CONVERSATION_SUMMARY_TOKENS. Follow-up questions reuse the intent, entities and CI of the previous question.
+CONVERSATION_HISTORY_TOKENS = 1500
+CONVERSATION_SUMMARY_TOKENS = 300
 
 # [Webex Server] Webex Bot Credentials
 WEBEX_BOT_ACCESS_TOKEN = credentials['WEBEX_BOT_ACCESS_TOKEN']
 WEBEX_BOT_NAME = "NetworkGPT"
 WEBEX_RODEV_ROOM = credentials['WEBEX_RODEV_ROOM']
+WEBEX_MESSAGES_URL = "https://webexapis.com/v1/messages"
+
+# [NetworkGPT] Streamed answers, Webex allows a message to be edited at most 10 times so edits are spaced out and the
+# last one is kept for the complete answer
+WEBEX_STREAM_PLACEHOLDER = "_Looking into it..._"
+WEBEX_STREAM_EDIT_INTERVAL = 1.5
+WEBEX_STREAM_MAX_EDITS = 9
@@ -0,0 +1,149 @@
+# package import
+import heapq
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+# local file import
+from Auxiliary.helper import write_to_json
+from Auxiliary.intent_classifier import (
+    STOPWORDS,
+    stem
+)
+
+logging.basicConfig()
+log = logging.getLogger("BM25_Index_Operation")
+log.setLevel(logging.INFO)
+
+# bumped whenever the weights are computed differently, so indexes persisted by an older build are rebuilt
+INDEX_VERSION = 2
+
+
+def index_terms(text):
+    """
+    Split text into BM25 terms. Identifiers such as "10.10.10.1", "C8Kv-1" or "24:0F:9B:7F:2C:04" are kept whole so
+    that exact lookups score highly, and their alphanumeric parts are indexed as well.
+    :param text: (str) record or question text
+    :return: (list[]) terms of the text
+    """
+    terms = []
+    for word in re.findall(r"[a-z0-9][a-z0-9.:_/-]*[a-z0-9]|[a-z0-9]", text.lower()):
+        parts = re.findall(r"[a-z0-9]+", word)
+        if len(parts) > 1:
+            terms.append(word)
+        for part in parts:
+            if part not in STOPWORDS:
+                terms.append(stem(part))
+    return terms
+
+
+def record_text(record):
+    # keys carry meaning too (e.g. "contain_malware": true), so index both keys and values
+    if isinstance(record, dict):
+        return " ".join(f"{key} {record_text(value)}" for key, value in record.items())
+    if isinstance(record, list):
+        return " ".join(record_text(item) for item in record)
+    return str(record)
+
+
+class BM25Index:
+    def __init__(self, documents, postings, digest):
+        """
+        Okapi BM25 index over every record of the KB. The BM25 weight of each (term, record) pair is computed when the
+        index is built, so a query only sums precomputed weights over the postings of its terms. Document frequencies
+        and lengths are counted per KB section, as retrieval always searches the sections of one intent: a section as
+        large as WAN_ISSUES must not make its own terms look common to every other section, nor the other way round.
+
+        :param documents: (list[]) (section, position) of each indexed record, addressed by document number
+        :param postings: (dict{}) term mapped to a list of [document number, BM25 weight] pairs
+        :param digest: (str) digest of the KB sections the index was built from
+        """
+        self.documents = documents
+        self.postings = postings
+        self.digest = digest
+
+    @classmethod
+    def build(cls, sections, digest, k1=1.2, b=0.75):
+        """
+        :param sections: (dict{}) KB section name mapped to its list of records
+        :param digest: (str) digest of the KB sections
+        :param k1: (float) BM25 term frequency saturation
+        :param b: (float) BM25 document length normalisation
+        :return: (BM25Index) index over every record of every section
+        """
+        documents = []
+        postings = {}
+        for section, records in sections.items():
+            term_frequencies = [Counter(index_terms(record_text(record))) for record in records]
+            if not term_frequencies:
+                continue
+            document_lengths = [sum(frequencies.values()) for frequencies in term_frequencies]
+            average_length = (sum(document_lengths) / len(document_lengths)) or 1.0
+            document_frequency = Counter()
+            for frequencies in term_frequencies:
+                document_frequency.update(frequencies.keys())
+
+            # terms found in every record of a section (e.g. the one system ip all WAN issues were raised on) keep a
+            # small positive weight, so the records still match a question that names them
+            for position, frequencies in enumerate(term_frequencies):
+                number = len(documents)
+                documents.append((section, position))
+                length_norm = k1 * (1 - b + b * document_lengths[position] / average_length)
+                for term, frequency in frequencies.items():
+                    idf = math.log(1 + (len(records) - document_frequency[term] + 0.5) /
+                                   (document_frequency[term] + 0.5))
+                    weight = idf * frequency * (k1 + 1) / (frequency + length_norm)
+                    postings.setdefault(term, []).append([number, round(weight, 6)])
+
+        return cls(documents=documents, postings=postings, digest=digest)
+
+    @classmethod
+    def load_or_build(cls, filepath, sections, digest):
+        """
+        Load the index persisted next to the KB files if it was built from the same KB content, otherwise rebuild it
+        and persist the new index.
+        :return: (BM25Index) index matching the given sections
+        """
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, "r") as file:
+                    persisted = json.load(file)
+                if persisted.get("version") == INDEX_VERSION and persisted["digest"] == digest:
+                    return cls(documents=[tuple(document) for document in persisted["documents"]],
+                               postings=persisted["postings"],
+                               digest=digest)
+            except Exception as e:
+                log.error(f"BM25 Index: Unable to load persisted index, rebuilding. Error: {e}")
+
+        index = cls.build(sections=sections, digest=digest)
+        try:
+            write_to_json(document=filepath, content={
+                "version": INDEX_VERSION,
+                "digest": index.digest,
+                "documents": index.documents,
+                "postings": index.postings
+            })
+            log.info(f"BM25 Index: Built and persisted index over {len(index.documents)} records.")
+        except Exception as e:
+            log.error(f"BM25 Index: Unable to persist index. Error: {e}")
+        return index
+
+    def search(self, query, k, sections=None):
+        """
+        :param query: (str) question asked by the user
+        :param k: (int) number of records to return
+        :param sections: (list[]) restrict results to these KB sections, or None for every section
+        :return: (list[]) (section, position, score) of the top-k records, best first
+        """
+        scores = {}
+        for term in set(index_terms(query)):
+            for number, weight in self.postings.get(term, []):
+                scores[number] = scores.get(number, 0.0) + weight
+
+        if sections is not None:
+            scores = {number: score for number, score in scores.items() if self.documents[number][0] in sections}
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[number][0], self.documents[number][1], score) for number, score in top]
@@ -0,0 +1,143 @@
+# package import
+import atexit
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+
+# local file import
+from Auxiliary.helper import write_to_json
+
+logging.basicConfig()
+log = logging.getLogger("Cache_Operation")
+log.setLevel(logging.INFO)
+
+
+class PersistentCache:
+    def __init__(self, name, filepath, max_entries, ttl, flush_interval=10):
+        """
+        Bounded LRU cache with a time-to-live per entry, persisted to a json file so that it survives restarts. Changes
+        only mark the cache dirty; a daemon thread writes them every flush_interval seconds, off the request path, and
+        whatever is left is written when the program exits.
+
+        :param name: (str) name of the cache, used in log messages and statistics
+        :param filepath: (str) json file the cache is loaded from and saved to
+        :param max_entries: (int) number of entries kept before the least recently used one is evicted
+        :param ttl: (int) seconds after which an entry expires
+        :param flush_interval: (float) seconds between writes of a changed cache
+        """
+        self.name = name
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        # serialises writes of the file, so a slow flush never overlaps the next one
+        self.write_lock = Lock()
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.load()
+        self.stop_event = Event()
+        self.flusher = Thread(target=self.flush_periodically, name=f"{name.replace(' ', '_')}_Flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.stop)
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, "r") as file:
+                entries = json.load(file)
+            now = time.time()
+            for key, entry in entries.items():
+                if now - entry["stored"] < self.ttl:
+                    self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            log.info(f"{self.name}: Loaded {len(self.entries)} entries.")
+        except Exception as e:
+            log.error(f"{self.name}: Unable to load cache, starting empty. Error: {e}")
+
+    def flush(self):
+        """
+        Write the cache to disk if it changed since the last write.
+        """
+        with self.write_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                # entries are replaced rather than modified, so a shallow copy is a consistent snapshot
+                snapshot = OrderedDict(self.entries)
+                self.dirty = False
+            try:
+                write_to_json(document=self.filepath, content=snapshot)
+            except Exception as e:
+                with self.lock:
+                    self.dirty = True
+                log.error(f"{self.name}: Unable to persist cache. Error: {e}")
+
+    def flush_periodically(self):
+        while not self.stop_event.wait(timeout=self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self.stop_event.set()
+        self.flush()
+
+    def get(self, key):
+        """
+        :param key: (str) cache key
+        :return: cached value, or None on a miss or if the entry has expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["stored"] >= self.ttl:
+                self.entries.pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = {"value": value, "stored": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def purge(self, predicate):
+        """
+        Remove every entry for which predicate(key, value) is True.
+        :return: (int) number of entries removed
+        """
+        with self.lock:
+            stale_keys = [key for key, entry in self.entries.items() if predicate(key, entry["value"])]
+            for key in stale_keys:
+                self.entries.pop(key)
+            if stale_keys:
+                self.dirty = True
+            return len(stale_keys)
+
+    def record_saving(self, seconds):
+        # latency a hit avoided, estimated by the caller from recent misses
+        with self.lock:
+            self.saved_seconds += seconds
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2)
+        }
@@ -0,0 +1,149 @@
+# package import
+import datetime
+import json
+
+# local file import
+from Auxiliary.entity_matcher import EntityMatcher
+from Auxiliary.intent_classifier import tokenise
+
+# record fields holding a severity, mapped from the values the controllers report to a 0-1 weight
+SEVERITY_WEIGHTS = {
+    "critical": 1.0,
+    "major": 0.75,
+    "high": 0.75,
+    "medium": 0.5,
+    "minor": 0.25,
+    "low": 0.25,
+    "warning": 0.25
+}
+
+# record fields holding a "%d/%m/%Y, %H:%M:%S" timestamp, in order of preference
+TIME_FIELDS = ["time", "last_occurence_time", "last_updated", "lastupdated", "last_connected_time", "time_end"]
+
+# weight of each relevance signal in the score of a record
+ENTITY_WEIGHT = 3.0
+KEYWORD_WEIGHT = 2.0
+SEVERITY_WEIGHT = 1.0
+RECENCY_WEIGHT = 1.0
+
+
+def record_timestamp(record):
+    for field in TIME_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str):
+            try:
+                return datetime.datetime.strptime(value, "%d/%m/%Y, %H:%M:%S").timestamp()
+            except ValueError:
+                continue
+    return None
+
+
+def record_severity(record):
+    severity = SEVERITY_WEIGHTS.get(str(record.get("severity", "")).lower(), 0.0)
+    if record.get("status") == "active" or record.get("contain_malware") is True:
+        severity = max(severity, 0.5)
+    return severity
+
+
+def view_features(view):
+    """
+    Compute, once per view, the question-independent features used to rank its records: the lower-cased row for
+    entity matching, the row's terms for keyword overlap, a severity weight and a 0-1 recency relative to the newest
+    record of the view.
+    :param view: (IntentView) materialised CI of an intent
+    :return: (list[]) (row, terms, severity, recency) tuples, one per record
+    """
+    if view.ranking_features is not None:
+        return view.ranking_features
+
+    timestamps = []
+    for record in view.records:
+        timestamps.append(record_timestamp(record) if isinstance(record, dict) else None)
+    known_timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    newest = max(known_timestamps) if known_timestamps else 0.0
+    span = (newest - min(known_timestamps)) if known_timestamps else 0.0
+
+    features = []
+    for record, row, timestamp in zip(view.records, view.rows, timestamps):
+        severity = record_severity(record) if isinstance(record, dict) else 0.0
+        if timestamp is None:
+            recency = 0.0
+        elif span:
+            recency = 1.0 - (newest - timestamp) / span
+        else:
+            recency = 1.0
+        features.append((row.lower(), set(tokenise(row)), severity, recency))
+
+    view.ranking_features = features
+    return features
+
+
+def rank_records(view, question, entities):
+    """
+    Order the records of a view by relevance to the question: entities named in the question, keyword overlap with
+    the question, severity and recency. Ties keep the view's original order.
+    :param view: (IntentView) materialised CI of an intent
+    :param question: (str) question asked by the user
+    :param entities: (list[]) entity values found in the question
+    :return: (list[]) record positions, most relevant first
+    """
+    question_terms = set(tokenise(question))
+    # whole entities only, so that "C8Kv-1" does not score the records of "C8Kv-10"
+    matcher = EntityMatcher(patterns={entity: entity for entity in entities}) if entities else None
+
+    scores = []
+    for position, (row, terms, severity, recency) in enumerate(view_features(view)):
+        score = SEVERITY_WEIGHT * severity + RECENCY_WEIGHT * recency
+        if matcher is not None:
+            score += ENTITY_WEIGHT * len(matcher.find(row))
+        if question_terms:
+            score += KEYWORD_WEIGHT * len(question_terms & terms) / len(question_terms)
+        scores.append((-score, position))
+    return [position for score, position in sorted(scores)]
+
+
+def retrieved_positions(view, records):
+    """
+    :param view: (IntentView) materialised CI of an intent
+    :param records: (list[]) records retrieved for a question, best first
+    :return: (list[]) positions of the retrieved records within the view, skipping records the view does not hold
+    """
+    if view.record_positions is None:
+        record_positions = {}
+        for position, record in enumerate(view.records):
+            record_positions.setdefault(json.dumps(record, sort_keys=True), position)
+        view.record_positions = record_positions
+    keys = [json.dumps(record, sort_keys=True) for record in records]
+    return [view.record_positions[key] for key in keys if key in view.record_positions]
+
+
+def select_ci(view, question, entities, token_budget, retrieved=None):
+    """
+    Serialise the CI of a view within a token budget. A view that fits is sent whole, in its stable precomputed form;
+    otherwise the most relevant records are packed until the budget is exhausted.
+    :param view: (IntentView) materialised CI of an intent
+    :param question: (str) question asked by the user
+    :param entities: (list[]) entity values found in the question
+    :param token_budget: (int) maximum estimated tokens of the returned CI
+    :param retrieved: (list[]) records retrieved for the question, best first. They are packed ahead of the ranked
+    records, which then fill the rest of the budget.
+    :return: (str) selected records, as a json array or a table
+    """
+    if view.tokens <= token_budget:
+        return view.payload
+
+    order = retrieved_positions(view=view, records=retrieved) if retrieved else []
+    order += rank_records(view=view, question=question, entities=entities)
+    selected = set()
+    # brackets of the json array, or the header of a table
+    used_tokens = view.overhead_tokens
+    for position in order:
+        if position in selected:
+            continue
+        row_tokens = view.row_tokens[position] + 1
+        if used_tokens + row_tokens > token_budget:
+            continue
+        selected.add(position)
+        used_tokens += row_tokens
+    # rendered in view order rather than rank order, so the same selection always renders the same text
+    return view.render(positions=sorted(selected))
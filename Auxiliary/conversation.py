@@ -0,0 +1,205 @@
+# package import
+import logging
+import re
+import time
+from threading import Lock, Thread
+
+# local file import
+from Auxiliary.helper import (
+    estimate_tokens,
+    truncate_to_tokens
+)
+
+logging.basicConfig()
+log = logging.getLogger("Conversation_Operation")
+log.setLevel(logging.INFO)
+
+# openings that tie a question to the previous one, e.g. "and its interfaces?" or "what about their uptime?"
+FOLLOW_UP_OPENER = r"^\s*(and|also|what about|how about|same for|then)\b"
+# references back to the previous question's entities
+FOLLOW_UP_REFERENCE = r"\b(it|its|their|them|they|those|these|that device|this device|that one|the same)\b"
+# words that scope a question over a whole section rather than the previous entities, e.g. "which devices ..."
+FOLLOW_UP_SCOPE = r"\b(all|any|every|each|which|how many)\b"
+# questions of at most this many words without an opener are elliptical, e.g. "their uptime?"
+FOLLOW_UP_MAX_WORDS = 4
+
+
+class FollowUp:
+    def __init__(self, intent, entities, ci, ci_key):
+        """
+        What was resolved for the last question of a room, reused when the next question follows up on it.
+
+        :param intent: (str) intent category of the last question
+        :param entities: (list[]) (entity, domain) tuples found in the last question
+        :param ci: (str) CI the last question was answered from, or None
+        :param ci_key: (str) KB digest and entities the CI was built for, or None
+        """
+        self.intent = intent
+        self.entities = entities
+        self.ci = ci
+        self.ci_key = ci_key
+
+
+class Conversation:
+    def __init__(self, room_id, history_tokens, summarise=None, summary_tokens=0):
+        """
+        Conversation context of one Webex room. Each room keeps its own chat history, so concurrent questions from
+        different rooms never read or overwrite each other's context. The history is a sliding window of the latest
+        turns within a token budget; older turns are folded into a rolling summary instead of being dropped.
+
+        :param room_id: (str) Webex room the conversation takes place in, or None for questions asked outside Webex
+        :param history_tokens: (int) estimated tokens of past turns sent with a request, 0 to send none
+        :param summarise: (function) called with (summary, turns), returns the summary updated with the turns or None.
+        Without it, turns leaving the window are dropped.
+        :param summary_tokens: (int) estimated tokens the summary may have, longer summaries are cut down to it
+        """
+        self.room_id = room_id
+        self.history_tokens = history_tokens
+        self.summarise = summarise
+        self.summary_tokens = summary_tokens
+        self.lock = Lock()
+        # past turns as (question, answer) tuples, oldest first
+        self.turns = []
+        self.summary = ""
+        # turns that left the window and wait to be folded into the summary
+        self.pending = []
+        self.summarising = False
+        self.last = None
+        self.last_active = time.time()
+
+    @staticmethod
+    def turn_tokens(turn):
+        return estimate_tokens(turn[0]) + estimate_tokens(turn[1])
+
+    def messages(self, system, user_prompt, context=None, history=True):
+        """
+        :param system: (str) system prompt
+        :param user_prompt: (str) prompt of the current request
+        :param context: (str) instructions and CI of the request, or None
+        :param history: (bool) False to leave out the room's history, e.g. for intent requests
+        :return: (list[]) chat messages to send for the request: the system prompt, the context, the summary of older
+        turns, the turns within the token budget, then the prompt. The system prompt and context come first as they are
+        the same for every room and turn over the same CI, which keeps them a cacheable prefix.
+        """
+        messages = [{"role": "system", "content": system}]
+        if context:
+            messages.append({"role": "system", "content": context})
+        with self.lock:
+            if history and self.summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+            for question, answer in self.turns if history else []:
+                messages.extend([{"role": "user", "content": question},
+                                 {"role": "assistant", "content": answer}])
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    def record(self, question, answer):
+        """
+        Add a turn to the history, folding the turns that no longer fit the token budget into the summary.
+        :param question: (str) question asked by the user, without the CI it was answered from
+        :param answer: (str) answer given
+        """
+        with self.lock:
+            self.last_active = time.time()
+            if not self.history_tokens:
+                return
+            self.turns.append((question, answer))
+            while self.turns and sum(self.turn_tokens(turn) for turn in self.turns) > self.history_tokens:
+                self.pending.append(self.turns.pop(0))
+            if self.summarise is None:
+                self.pending = []
+            if not self.pending or self.summarising:
+                return
+            self.summarising = True
+        # summarised off the request path, the turns are out of the window either way
+        Thread(target=self.fold, daemon=True).start()
+
+    def fold(self):
+        while True:
+            with self.lock:
+                turns, self.pending = self.pending, []
+                summary = self.summary
+                if not turns:
+                    self.summarising = False
+                    return
+            try:
+                summary = self.summarise(summary, turns)
+            except Exception as e:
+                log.error(f"Conversation Summary: Unknown exception: Deeper troubleshooting required to fix {e}")
+                summary = None
+            # the summary is sent with every later request, so its budget is enforced rather than trusted to the model
+            if summary and self.summary_tokens and estimate_tokens(summary) > self.summary_tokens:
+                log.warning(f"Conversation Summary: Over {self.summary_tokens} tokens, truncated.")
+                summary = truncate_to_tokens(text=summary, max_tokens=self.summary_tokens)
+            if summary:
+                with self.lock:
+                    self.summary = summary
+
+    def remember(self, follow_up):
+        """
+        :param follow_up: (FollowUp) intent, entities and CI resolved for the question just answered, or None when the
+        question left nothing to follow up on
+        """
+        with self.lock:
+            self.last = follow_up
+
+    def follow_up(self, question, entities):
+        """
+        :param question: (str) question asked by the user
+        :param entities: (list[]) entities found in the question
+        :return: (FollowUp) what was resolved for the previous question if this one follows up on it, otherwise None
+        """
+        with self.lock:
+            last = self.last
+        if last is None or entities:
+            return None
+        question = question.lower()
+        opener = re.search(FOLLOW_UP_OPENER, question)
+        reference = re.search(FOLLOW_UP_REFERENCE, question)
+        # complete questions such as "list all devices and their software versions" also refer to "their" records,
+        # only an opener or an elliptical question ties them to the previous one
+        if not opener and len(re.findall(r"[\w.:/-]+", question)) > FOLLOW_UP_MAX_WORDS:
+            return None
+        # the previous entities are only inherited when the question refers back to them, or when it opens as a
+        # follow-up without scoping itself over a whole section, e.g. "and the interfaces?"
+        if not reference and (not opener or re.search(FOLLOW_UP_SCOPE, question)):
+            return None
+        return last
+
+
+class ConversationRegistry:
+    def __init__(self, idle_timeout, history_tokens=0, summarise=None, summary_tokens=0):
+        """
+        :param idle_timeout: (int) seconds after which the context of an idle room is dropped
+        :param history_tokens: (int) token budget of each room's history window
+        :param summarise: (function) folds turns leaving a window into the room's summary, see Conversation
+        :param summary_tokens: (int) token budget of each room's summary
+        """
+        self.idle_timeout = idle_timeout
+        self.history_tokens = history_tokens
+        self.summarise = summarise
+        self.summary_tokens = summary_tokens
+        self.lock = Lock()
+        self.conversations = {}
+
+    def get(self, room_id):
+        """
+        :param room_id: (str) Webex room, or None for questions asked outside Webex
+        :return: (Conversation) context of the room, created on first use
+        """
+        with self.lock:
+            now = time.time()
+            for idle_room in [room for room, conversation in self.conversations.items()
+                              if now - conversation.last_active >= self.idle_timeout]:
+                del self.conversations[idle_room]
+            conversation = self.conversations.get(room_id)
+            if conversation is None:
+                conversation = self.conversations[room_id] = Conversation(room_id=room_id,
+                                                                          history_tokens=self.history_tokens,
+                                                                          summarise=self.summarise,
+                                                                          summary_tokens=self.summary_tokens)
+            conversation.last_active = now
+            return conversation
+
+    def __len__(self):
+        return len(self.conversations)
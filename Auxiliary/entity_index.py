@@ -0,0 +1,228 @@
+# package import
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("Entity_Index_Generation")
+log.setLevel(logging.INFO)
+
+# domain reported for entities first seen in each KB section
+SECTION_DOMAINS = {
+    "LAN_DEVICES": "LAN",
+    "LAN_INTERFACES": "LAN",
+    "LAN_CLIENTS": "LAN",
+    "LAN_ISSUES": "LAN",
+    "WAN_DEVICES": "WAN",
+    "WAN_INTERFACES": "WAN",
+    "WAN_ISSUES": "WAN",
+    "AUTHENTICATION_POLICIES": "ISE",
+    "AUTHORIZATION_POLICIES": "ISE",
+    "SAMSUNG_DEVICES": "SAMSUNG",
+    "STEALTHWATCH_ALARMS": "STEALTHWATCH"
+}
+
+# KB section mapped to the (entity kind, field path) pairs that identify or mention an entity. A dotted path walks into
+# nested dicts and lists, e.g. "interfaces.ipv4Address" yields the address of every interface of a device. Device
+# sections come first so that an entity takes the domain of the record that defines it rather than one that mentions it.
+ENTITY_FIELDS = {
+    "LAN_DEVICES": [
+        ("hostname", "hostname"),
+        ("management_ip", "managementIPAddress"),
+        ("serial_number", "serialNumber"),
+        ("serial_number", "modules.serial_number"),
+        ("interface_ip", "interfaces.ipv4Address"),
+        ("mac_address", "interfaces.macAddress")
+    ],
+    "WAN_DEVICES": [
+        ("hostname", "host-name"),
+        ("management_ip", "system-ip"),
+        ("interface_ip", "interfaces.ip-address"),
+        ("mac_address", "interfaces.hwaddr")
+    ],
+    "SAMSUNG_DEVICES": [
+        ("model", "model"),
+        ("serial_number", "serial_number"),
+        ("client_ip", "ip_address")
+    ],
+    "LAN_INTERFACES": [
+        ("hostname", "hostname"),
+        ("interface_ip", "interfaces.ipv4Address"),
+        ("mac_address", "interfaces.macAddress")
+    ],
+    "WAN_INTERFACES": [
+        ("hostname", "hostname"),
+        ("interface_ip", "interfaces.ip-address"),
+        ("mac_address", "interfaces.hwaddr")
+    ],
+    "LAN_CLIENTS": [
+        ("client_mac", "client_mac"),
+        ("client_ip", "client_ip"),
+        ("hostname", "connected_device_hostname"),
+        ("management_ip", "connected_device_ip")
+    ],
+    "LAN_ISSUES": [
+        ("hostname", "deviceName")
+    ],
+    "WAN_ISSUES": [
+        ("management_ip", "system_ip")
+    ],
+    "STEALTHWATCH_ALARMS": [
+        ("sna_host_ip", "host_ip_address")
+    ],
+    "AUTHENTICATION_POLICIES": [
+        ("policy_name", "name")
+    ],
+    "AUTHORIZATION_POLICIES": [
+        ("policy_name", "name")
+    ]
+}
+
+# KB section mapped to (field path, device section, device key path, device entity fields) for records that name a
+# device by one identifier only. Such records are also indexed under the device's other identifiers, e.g. a WAN issue
+# raised on system ip 10.10.10.1 under the hostname of the WAN device with that system ip.
+DEVICE_REFERENCES = {
+    "LAN_ISSUES": ("deviceName", "LAN_DEVICES", "hostname", [("management_ip", "managementIPAddress")]),
+    "WAN_ISSUES": ("system_ip", "WAN_DEVICES", "system-ip", [("hostname", "host-name")])
+}
+
+
+def field_values(record, path):
+    """
+    Yield the values found at a dotted field path in a record, walking through nested lists.
+    :param record: (dict{}) KB record
+    :param path: (str) dotted field path, e.g. "interfaces.ip-address"
+    :return: (generator) string values at the path
+    """
+    values = [record]
+    for key in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                value_list = value
+            else:
+                value_list = [value]
+            for item in value_list:
+                if isinstance(item, dict) and item.get(key) is not None:
+                    next_values.append(item[key])
+        values = next_values
+    for value in values:
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, (str, int, float)):
+                yield str(item)
+
+
+def normalise_entity(kind, value):
+    """
+    :return: (str) canonical form of an entity value, or an empty string if the value does not identify anything
+    """
+    value = value.strip()
+    if value in ["", "-", "None", "null"]:
+        return ""
+    if kind in ["interface_ip", "management_ip", "client_ip", "sna_host_ip"]:
+        # vManage reports interface addresses in CIDR notation
+        value = value.split("/")[0]
+    if kind == "policy_name" and value.isalpha():
+        # single plain words such as "Default" or "Quarantine" are too generic to be treated as entities
+        return ""
+    return value
+
+
+class EntityIndex:
+    def __init__(self, sections):
+        """
+        Unified index of every entity of the network (hostnames, management and interface IPs, MACs, serial numbers,
+        client MACs/IPs, SNA host IPs, Knox models and ISE policy names), spanning all controllers. Each entry points to
+        the exact KB records that mention the entity, so per-entity questions can be answered from those records only.
+
+        :param sections: (dict{}) KB section name mapped to its list of records
+        """
+        # lower-cased entity value mapped to {"entity", "domain", "kinds", "records"}, where records is a list of
+        # (section name, record position) tuples in section order
+        self.entries = {}
+
+        for section, fields in ENTITY_FIELDS.items():
+            devices = self.device_lookup(section=section, sections=sections)
+            for position, record in enumerate(sections.get(section, [])):
+                if not isinstance(record, dict):
+                    continue
+                for kind, path in fields:
+                    for value in field_values(record=record, path=path):
+                        entity = normalise_entity(kind=kind, value=value)
+                        if entity:
+                            self.add(entity=entity, kind=kind, section=section, position=position)
+                if devices:
+                    self.add_device_references(record=record, section=section, position=position, devices=devices)
+
+        if self.entries:
+            log.info(f"Entity Index Generation: {len(self.entries)} entities indexed.")
+
+    @staticmethod
+    def device_lookup(section, sections):
+        """
+        :return: (dict{}) lower-cased device identifier mapped to the device record, for sections in DEVICE_REFERENCES
+        """
+        if section not in DEVICE_REFERENCES:
+            return {}
+        path, device_section, key_path, device_fields = DEVICE_REFERENCES[section]
+        devices = {}
+        for device in sections.get(device_section, []):
+            if isinstance(device, dict):
+                for key in field_values(record=device, path=key_path):
+                    devices.setdefault(key.strip().lower(), device)
+        return devices
+
+    def add_device_references(self, record, section, position, devices):
+        path, device_section, key_path, device_fields = DEVICE_REFERENCES[section]
+        for value in field_values(record=record, path=path):
+            device = devices.get(value.strip().lower())
+            if device is None:
+                continue
+            for kind, device_path in device_fields:
+                for device_value in field_values(record=device, path=device_path):
+                    entity = normalise_entity(kind=kind, value=device_value)
+                    if entity:
+                        self.add(entity=entity, kind=kind, section=section, position=position)
+
+    def add(self, entity, kind, section, position):
+        entry = self.entries.setdefault(entity.lower(), {
+            "entity": entity,
+            "domain": SECTION_DOMAINS[section],
+            "kinds": [],
+            "records": []
+        })
+        if kind not in entry["kinds"]:
+            entry["kinds"].append(kind)
+        if (section, position) not in entry["records"][-1:]:
+            entry["records"].append((section, position))
+
+    def lookup(self, entity):
+        """
+        :param entity: (str) entity value, case-insensitive
+        :return: (dict{}) index entry of the entity, or None if the entity is unknown
+        """
+        return self.entries.get(entity.strip().lower())
+
+    def device_domain_mapping(self):
+        """
+        :return: (dict{}) hostname and Knox model of every device mapped to its domain, as in device_domain_map.json
+        """
+        return {entry["entity"]: entry["domain"] for entry in self.entries.values()
+                if "hostname" in entry["kinds"] or "model" in entry["kinds"]}
+
+    def records(self, entities, sections, section_names):
+        """
+        Collect the KB records that mention any of the given entities, restricted to the given sections.
+        :param entities: (list[]) entity values, case-insensitive
+        :param sections: (dict{}) KB section name mapped to its list of records
+        :param section_names: (list[]) sections to collect records from
+        :return: (dict{}) section name mapped to its matching records, in section order, for sections with a match
+        """
+        positions = {}
+        for entity in entities:
+            entry = self.lookup(entity)
+            if entry is None:
+                continue
+            for section, position in entry["records"]:
+                if section in section_names:
+                    positions.setdefault(section, set()).add(position)
+        return {section: [sections[section][position] for position in sorted(section_positions)]
+                for section, section_positions in positions.items()}
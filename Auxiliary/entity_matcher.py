@@ -0,0 +1,116 @@
+# package import
+from collections import deque
+
+
+class EntityMatcher:
+    def __init__(self, patterns):
+        """
+        Aho-Corasick automaton over entity names (hostnames, IPs, MACs, serials, Knox models). Built once per KB
+        generation, it finds every known entity in a question with a single linear pass, instead of testing each entity
+        against the question in turn. Matching is case-insensitive and only accepts whole entities, i.e. the characters
+        either side of a hit must not be alphanumeric, so "C8Kv-1" does not match inside "C8Kv-10".
+
+        :param patterns: (dict{}) entity alias mapped to the value returned when that alias is found in a question
+        """
+        # trie nodes: outgoing transitions, failure link and (pattern length, value) outputs ending at the node
+        self.transitions = [{}]
+        self.failure = [0]
+        self.outputs = [[]]
+
+        for alias, value in patterns.items():
+            alias = alias.strip().lower()
+            if alias:
+                self.add(alias=alias, value=value)
+        self.link()
+
+    def add(self, alias, value):
+        node = 0
+        for char in alias:
+            if char not in self.transitions[node]:
+                self.transitions.append({})
+                self.failure.append(0)
+                self.outputs.append([])
+                self.transitions[node][char] = len(self.transitions) - 1
+            node = self.transitions[node][char]
+        self.outputs[node].append((len(alias), value))
+
+    def link(self):
+        # breadth-first construction of failure links, merging the outputs of each node's longest proper suffix
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                queue.append(child)
+                fallback = self.failure[node]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.failure[fallback]
+                self.failure[child] = self.transitions[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.failure[child]]
+
+    def spans(self, text):
+        """
+        Locate the entities mentioned in the text. Overlapping hits are resolved in favour of the longest entity.
+        :param text: (str) question asked by the user
+        :return: (list[]) (start, end, value) tuples of the matched entities, in order of appearance
+        """
+        text = text.lower()
+        hits = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.transitions[node]:
+                node = self.failure[node]
+            node = self.transitions[node].get(char, 0)
+            for length, value in self.outputs[node]:
+                start = position - length + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if position + 1 < len(text) and text[position + 1].isalnum():
+                    continue
+                hits.append((start, position + 1, value))
+
+        # keep the longest hit among overlapping ones
+        hits.sort(key=lambda hit: (hit[0], -(hit[1] - hit[0])))
+        spans = []
+        covered_until = 0
+        for start, end, value in hits:
+            if start < covered_until:
+                continue
+            covered_until = end
+            spans.append((start, end, value))
+        return spans
+
+    def find(self, text):
+        """
+        Return the values of the entities mentioned in the text, each value once, in order of first appearance.
+        :param text: (str) question asked by the user
+        :return: (list[]) values of the matched entities
+        """
+        values = []
+        for start, end, value in self.spans(text):
+            if value not in values:
+                values.append(value)
+        return values
+
+
+def build_entity_matcher(entity_index, device_domain_mapping):
+    """
+    Compile the entity matcher of a KB generation from its entity index, plus any manually maintained entries of the
+    device domain map. Every alias resolves to an (entity, domain) tuple, where entity is the indexed entity name.
+    :param entity_index: (EntityIndex) cross-domain entity index of the KB generation
+    :param device_domain_mapping: (dict{}) device hostname or model mapped to its domain
+    :return: (EntityMatcher) compiled matcher
+    """
+    patterns = {}
+    for entity, domain in device_domain_mapping.items():
+        patterns[entity] = (entity, domain)
+
+    for entry in entity_index.entries.values():
+        entity = entry["entity"]
+        patterns[entity] = (entity, entry["domain"])
+        if "model" in entry["kinds"] and "(" in entity:
+            # users rarely type the full "Galaxy S24 Ultra (SM-S928B)", so also match the name and the model code
+            name, code = entity.split("(", 1)
+            patterns[name.strip()] = (entity, entry["domain"])
+            patterns[code.rstrip(")").strip()] = (entity, entry["domain"])
+
+    return EntityMatcher(patterns=patterns)
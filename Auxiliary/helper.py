@@ -1,6 +1,9 @@
 # package import
 import datetime
 import json
+import math
+import os
+import re
 
 
 def substring_exists(string_a, string_b):
@@ -14,6 +17,56 @@ def substring_exists(string_a, string_b):
     return False
 
 
+def estimate_tokens(text):
+    # approximate BPE token count without a tokenizer: letters ~4 chars/token, digits ~3 chars/token, 1 per symbol
+    tokens = 0
+    for chunk in re.findall(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]", text):
+        if chunk[0].isalpha():
+            tokens += math.ceil(len(chunk) / 4)
+        elif chunk[0].isdigit():
+            tokens += math.ceil(len(chunk) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    :param text: (str) text to shorten
+    :param max_tokens: (int) estimated tokens the text may have at most
+    :return: (str) longest prefix of the text within max_tokens, as counted by estimate_tokens
+    """
+    tokens = 0
+    end = 0
+    for chunk in re.finditer(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]", text):
+        value = chunk.group(0)
+        if value[0].isalpha():
+            tokens += math.ceil(len(value) / 4)
+        elif value[0].isdigit():
+            tokens += math.ceil(len(value) / 3)
+        else:
+            tokens += 1
+        if tokens > max_tokens:
+            break
+        end = chunk.end()
+    else:
+        return text
+    return text[:end]
+
+
+def normalise_question(question, entity_spans=()):
+    """
+    Reduce a question to a canonical form for cache lookups: entity spans are replaced by a placeholder naming the
+    entity's domain, then the text is lower-cased and stripped of punctuation and repeated whitespace.
+    :param question: (str) question asked by the user
+    :param entity_spans: (list[]) (start, end, (entity, domain)) tuples from EntityMatcher.spans(), to be masked
+    :return: (str) normalised question
+    """
+    for start, end, (entity, domain) in sorted(entity_spans, reverse=True):
+        question = question[:start] + f" {domain.lower()}_entity " + question[end:]
+    return " ".join(re.findall(r"[a-z0-9_]+", question.lower()))
+
+
 def python_datetime_converter(python_time):
     return datetime.datetime.strptime(python_time,"%Y-%m-%dT%H:%M:%SZ").strftime("%d/%m/%Y, %H:%M:%S")
 
@@ -37,6 +90,9 @@ def deduplicate_list(input_list):
 
 def write_to_json(document, content):
     json_string = json.dumps(content)
-    json_file = open(document, "w")
+    # write to a temporary file and swap it in, so readers never see a partially written document
+    temp_document = document + ".tmp"
+    json_file = open(temp_document, "w")
     json_file.write(json_string)
     json_file.close()
+    os.replace(temp_document, document)
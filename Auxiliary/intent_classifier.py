@@ -0,0 +1,230 @@
+# package import
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from threading import Lock
+
+logging.basicConfig()
+log = logging.getLogger("Intent_Classifier_Operation")
+log.setLevel(logging.INFO)
+
+STOPWORDS = {
+    "a", "about", "affected", "all", "an", "and", "any", "are", "as", "ask", "asks", "be", "by", "can", "contains",
+    "could", "detail", "details", "do", "does", "for", "from", "give", "have", "how", "i", "in", "include",
+    "includes", "information", "is", "it", "its", "like", "list", "many", "may", "me", "much", "my", "of", "on", "or",
+    "our", "please", "question", "refer", "show", "such", "tell", "that", "the", "their", "them", "there", "these",
+    "this", "to", "us", "was", "we", "what", "when", "where", "which", "who", "why", "will", "with", "would", "you"
+}
+
+# domain reported by the entity index mapped to the prefix of the intent categories it hints at
+DOMAIN_CATEGORY_PREFIXES = {
+    "LAN": "LAN_",
+    "WAN": "WAN_",
+    "ISE": "ISE_",
+    "SAMSUNG": "KNOX_",
+    "STEALTHWATCH": "STEALTHWATCH_"
+}
+
+
+def stem(word):
+    # fold plurals so that "issues"/"issue" and "policies"/"policy" share a term
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenise(text):
+    """
+    :param text: (str) question or category description
+    :return: (list[]) stemmed terms of the text, without stopwords and bare numbers
+    """
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", text.lower())
+            if word not in STOPWORDS and len(word) > 1 and not word.isdigit()]
+
+
+class IntentClassifier:
+    def __init__(self, history_filepath, min_score, min_margin, name_weight=0.3, domain_boost=0.15,
+                 retrain_every=20, max_history=5000):
+        """
+        Local TF-IDF classifier that assigns an intent category without an LLM round-trip when it is confident. Each
+        category is represented by its description in the INTENT_CATEGORIES sheet and every logged question the LLM
+        previously classified into it. The share of the category name's terms found in the question (e.g. "lan" and
+        "device" for LAN_DEVICES) and the domains of entities found in the question add to the similarity score.
+
+        :param history_filepath: (str) json-lines file of {"question", "intent"} decisions made by the LLM
+        :param min_score: (float) minimum cosine similarity of the best category for a local decision
+        :param min_margin: (float) minimum lead of the best category over the runner-up for a local decision
+        :param name_weight: (float) score added when every term of a category name appears in the question
+        :param domain_boost: (float) score added to categories of a domain hinted by an entity in the question
+        :param retrain_every: (int) number of newly logged questions after which the category vectors are rebuilt
+        :param max_history: (int) number of logged questions kept, the log is rotated to <history_filepath>.1 when
+        it reaches this many lines
+        """
+        self.history_filepath = history_filepath
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.name_weight = name_weight
+        self.domain_boost = domain_boost
+        self.retrain_every = retrain_every
+        self.max_history = max_history
+        self.rotated_filepath = history_filepath + ".1"
+        self.lock = Lock()
+        # held while training, so only one thread rebuilds the vectors at a time
+        self.train_lock = Lock()
+        self.history = self.load_history()
+        # lines in the current log file, and questions logged since start, the history itself stops growing at the cap
+        self.history_lines = self.count_lines(filepath=self.history_filepath)
+        self.recorded = 0
+        self.trained_intent_kb = None
+        self.trained_recorded = 0
+        self.idf = {}
+        self.vectors = {}
+        self.name_terms = {}
+
+    def load_history(self):
+        history = []
+        for filepath in [self.rotated_filepath, self.history_filepath]:
+            if not os.path.exists(filepath):
+                continue
+            try:
+                with open(filepath, "r") as file:
+                    for line in file:
+                        if line.strip():
+                            history.append(json.loads(line))
+            except Exception as e:
+                log.error(f"Intent Classifier: Unable to load question history, continuing without it. Error: {e}")
+        return history[-self.max_history:]
+
+    @staticmethod
+    def count_lines(filepath):
+        if not os.path.exists(filepath):
+            return 0
+        try:
+            with open(filepath, "r") as file:
+                return sum(1 for _ in file)
+        except Exception as e:
+            log.error(f"Intent Classifier: Unable to read {filepath}. Error: {e}")
+            return 0
+
+    def record(self, question, intent):
+        """
+        Log an intent decided by the LLM, to be learnt from at the next retraining.
+        :param question: (str) question asked by the user
+        :param intent: (str) intent category returned by the LLM
+        """
+        entry = {"question": question, "intent": intent}
+        with self.lock:
+            self.history.append(entry)
+            del self.history[:-self.max_history]
+            self.recorded += 1
+            try:
+                # the previous log is replaced, so at most twice max_history lines are kept on disk
+                if self.history_lines >= self.max_history:
+                    os.replace(self.history_filepath, self.rotated_filepath)
+                    self.history_lines = 0
+                    log.info(f"Intent Classifier: Question history rotated to {self.rotated_filepath}.")
+                with open(self.history_filepath, "a") as file:
+                    file.write(json.dumps(entry) + "\n")
+                self.history_lines += 1
+            except Exception as e:
+                log.error(f"Intent Classifier: Unable to log question history. Error: {e}")
+
+    def train(self, intent_kb):
+        """
+        Build one L2-normalised TF-IDF vector per intent category.
+        :param intent_kb: (list[]) rows of the INTENT_CATEGORIES sheet as {"category", "description"} dicts
+        """
+        with self.lock:
+            history = list(self.history)
+            recorded = self.recorded
+
+        categories = [category["category"] for category in intent_kb]
+        name_terms = {}
+        term_counts = {}
+        for category in intent_kb:
+            name_terms[category["category"]] = set(tokenise(category["category"].replace("_", " ")))
+            term_counts[category["category"]] = Counter(tokenise(category["description"]))
+        for entry in history:
+            if entry.get("intent") in term_counts:
+                term_counts[entry["intent"]].update(tokenise(entry["question"]))
+
+        document_frequency = Counter()
+        for counts in term_counts.values():
+            document_frequency.update(counts.keys())
+        idf = {term: math.log((len(categories) + 1) / (frequency + 1)) + 1
+               for term, frequency in document_frequency.items()}
+
+        vectors = {}
+        for category, counts in term_counts.items():
+            vector = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(weight ** 2 for weight in vector.values())) or 1.0
+            vectors[category] = {term: weight / norm for term, weight in vector.items()}
+
+        # swapped in together, so a concurrent classification never mixes old and new state
+        with self.lock:
+            self.idf = idf
+            self.vectors = vectors
+            self.name_terms = name_terms
+            self.trained_intent_kb = intent_kb
+            self.trained_recorded = recorded
+        log.info(f"Intent Classifier: Trained on {len(categories)} categories and {len(history)} logged questions.")
+
+    def needs_training(self, intent_kb):
+        # retrain when the prompt workbook was recompiled or enough new questions were logged
+        with self.lock:
+            return intent_kb is not self.trained_intent_kb or \
+                self.recorded - self.trained_recorded >= self.retrain_every
+
+    def ensure_trained(self, intent_kb):
+        if not self.needs_training(intent_kb=intent_kb):
+            return
+        # threads arriving while another one trains wait for it, then find the new state already built
+        with self.train_lock:
+            if self.needs_training(intent_kb=intent_kb):
+                self.train(intent_kb=intent_kb)
+
+    def score(self, question, domains):
+        """
+        :param question: (str) question asked by the user
+        :param domains: (list[]) domains of the entities detected in the question
+        :return: (list[]) (intent, score) tuples, best first
+        """
+        with self.lock:
+            idf, vectors, name_terms = self.idf, self.vectors, self.name_terms
+        terms = set(tokenise(question))
+        query = {term: idf[term] for term in terms if term in idf}
+        norm = math.sqrt(sum(weight ** 2 for weight in query.values())) or 1.0
+
+        hinted_prefixes = [DOMAIN_CATEGORY_PREFIXES[domain] for domain in domains
+                           if domain in DOMAIN_CATEGORY_PREFIXES]
+        scores = []
+        for category, vector in vectors.items():
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query.items()) / norm
+            if name_terms.get(category):
+                score += self.name_weight * len(terms & name_terms[category]) / len(name_terms[category])
+            if any(category.startswith(prefix) for prefix in hinted_prefixes):
+                score += self.domain_boost
+            scores.append((category, score))
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    def classify(self, question, domains, intent_kb):
+        """
+        Assign the intent locally when the best category is both a good match and clearly ahead of the runner-up.
+        :param question: (str) question asked by the user
+        :param domains: (list[]) domains of the entities detected in the question
+        :param intent_kb: (list[]) rows of the INTENT_CATEGORIES sheet as {"category", "description"} dicts
+        :return: (str) intent category, or None if the question is ambiguous and should go to the LLM
+        """
+        self.ensure_trained(intent_kb=intent_kb)
+        scores = self.score(question=question, domains=domains)
+        if len(scores) < 2:
+            return None
+        (best, best_score), runner_up_score = scores[0], scores[1][1]
+        if best_score >= self.min_score and best_score - runner_up_score >= self.min_margin:
+            return best
+        return None
@@ -0,0 +1,351 @@
+# package import
+import logging
+import re
+from collections import Counter
+from threading import Lock
+
+# local file import
+from Auxiliary.entity_index import field_values
+from Auxiliary.intent_classifier import STOPWORDS
+
+logging.basicConfig()
+log = logging.getLogger("KB_Query_Operation")
+log.setLevel(logging.INFO)
+
+
+def to_number(value):
+    """
+    :param value: (str, int, float) KB field value, e.g. 55.7, "37.00" or "80%"
+    :return: (float) numeric value, or None if the value is not a number
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except ValueError:
+        return None
+
+
+def wan_memory_usage(record):
+    # vManage reports free and total memory rather than a usage percentage
+    free, total = to_number(record.get("mem_free")), to_number(record.get("mem_total"))
+    return round(100 * (1 - free / total), 1) if free is not None and total else None
+
+
+def field_value(record, field):
+    """
+    :param record: (dict{}) KB record
+    :param field: (str, function) dotted field path, or a function deriving the value from the record
+    :return: value of the field, or None if the record does not have it
+    """
+    if callable(field):
+        return field(record)
+    values = list(field_values(record=record, path=field))
+    if not values:
+        return record.get(field) if isinstance(record.get(field), bool) else None
+    return values[0] if len(values) == 1 else ", ".join(values)
+
+
+class KBQuery:
+    def __init__(self, records):
+        """
+        Minimal query engine over the records of a KB section. Each operator returns a new query or a result, so
+        operators chain, e.g. KBQuery(records).filter("reachability", "eq", "Unreachable").count().
+
+        :param records: (list[]) KB records to query
+        """
+        self.records = list(records)
+
+    def filter(self, field, op, value):
+        """
+        :param field: (str, function) dotted field path or derived field
+        :param op: (str) "eq", "ne", "gt", "ge", "lt", "le" or "contains". String comparisons ignore case.
+        :param value: value compared against
+        :return: (KBQuery) records satisfying the condition
+        """
+        def matches(record):
+            actual = field_value(record=record, field=field)
+            if op in ["gt", "ge", "lt", "le"]:
+                actual, expected = to_number(actual), to_number(value)
+                if actual is None or expected is None:
+                    return False
+                return {"gt": actual > expected, "ge": actual >= expected,
+                        "lt": actual < expected, "le": actual <= expected}[op]
+            if isinstance(value, bool):
+                equal = actual is value
+            else:
+                equal = str(actual).lower() == str(value).lower()
+            if op == "eq":
+                return equal
+            if op == "ne":
+                return not equal
+            if op == "contains":
+                return str(value).lower() in str(actual).lower()
+            raise ValueError(f"Unknown operator {op}")
+
+        return KBQuery(record for record in self.records if matches(record))
+
+    def project(self, fields):
+        """
+        :param fields: (dict{}) output name mapped to a dotted field path or derived field
+        :return: (list[]) records reduced to the given fields
+        """
+        return [{name: field_value(record=record, field=field) for name, field in fields.items()}
+                for record in self.records]
+
+    def count(self):
+        return len(self.records)
+
+    def group(self, field):
+        """
+        :param field: (str, function) dotted field path or derived field
+        :return: (list[]) (value, count) tuples, largest group first
+        """
+        return Counter(str(field_value(record=record, field=field)) for record in self.records).most_common()
+
+    def top(self, field, k, descending=True):
+        """
+        :param field: (str, function) numeric field to order by; records without a numeric value are left out
+        :param k: (int) number of records to keep
+        :param descending: (bool) True for the highest values first
+        :return: (KBQuery) k records with the highest (or lowest) values
+        """
+        numbered = [record for record in self.records if to_number(field_value(record=record, field=field)) is not None]
+        numbered.sort(key=lambda record: to_number(field_value(record=record, field=field)), reverse=descending)
+        return KBQuery(numbered[:k])
+
+
+# KB sections the router answers from. "pattern" recognises the section in a question, "display" names the fields
+# listed per record, "metrics" the numeric fields comparisons and top-k can use, "states" the words that filter on a
+# field value and "groups" the fields a count can be broken down by. Sections are tried in order. A section pattern
+# must not match a state word of its section, e.g. "wireless clients", or the state would never filter the records.
+QUERY_SECTIONS = {
+    "LAN_ISSUES": {
+        "label": "LAN issues",
+        "pattern": r"\b(lan|dnac|campus) (issues?|problems?)\b",
+        "display": ["deviceName", "name"],
+        "metrics": {},
+        "states": {r"active": ("status", "eq", "active")},
+        "groups": {r"devices?": "deviceName", r"status": "status"}
+    },
+    "WAN_ISSUES": {
+        "label": "WAN issues",
+        "pattern": r"\b(wan|sd-?wan|vmanage) (issues?|alarms?|problems?)\b",
+        "display": ["system_ip", "error_message", "time"],
+        "metrics": {},
+        "states": {r"critical": ("severity", "eq", "Critical"), r"active": ("status", "eq", "active")},
+        "groups": {r"(devices?|system ips?)": "system_ip", r"severity": "severity",
+                   r"(errors?|messages?)": "error_message"}
+    },
+    "STEALTHWATCH_ALARMS": {
+        "label": "Stealthwatch alarms",
+        "pattern": r"\b(stealthwatch|sna|secure network analytics) (alarms?|issues?)\b",
+        "display": ["host_ip_address", "host_type"],
+        "metrics": {},
+        "states": {r"internal": ("host_type", "eq", "internal"), r"external": ("host_type", "eq", "external")},
+        "groups": {r"(host )?types?": "host_type", r"hosts?": "host_ip_address"}
+    },
+    "LAN_CLIENTS": {
+        "label": "LAN clients",
+        "pattern": r"\b(lan )?(clients?|endpoints?)\b",
+        "display": ["client_mac", "client_ip", "connected_device_hostname"],
+        "metrics": {r"health": "health", r"rssi": "rssi", r"snr": "snr", r"vlan": "vlan"},
+        # "connected to/on <device>" names the device rather than the status
+        "states": {r"connected(?! (to|on)\b)": ("status", "eq", "CONNECTED"),
+                   r"disconnected": ("status", "ne", "CONNECTED"),
+                   r"wired": ("client_type", "eq", "WIRED"), r"wireless": ("client_type", "eq", "WIRELESS")},
+        "groups": {r"(devices?|switch(es)?)": "connected_device_hostname", r"vlans?": "vlan",
+                   r"types?": "client_type", r"locations?": "location"}
+    },
+    "SAMSUNG_DEVICES": {
+        "label": "Knox phones",
+        "pattern": r"\b((knox|samsung) (phones?|devices?|mobiles?)|(knox|samsung)|phones?|mobiles?)\b",
+        "display": ["mobile_id", "model", "username"],
+        "metrics": {r"battery( level)?": "battery"},
+        "states": {r"(contains? |with |have |has )?malware": ("contain_malware", "eq", True),
+                   r"unlocked": ("lock_status", "eq", "Unlocked"), r"locked": ("lock_status", "eq", "Locked"),
+                   r"roaming": ("roaming", "eq", True)},
+        "groups": {r"models?": "model", r"organi[sz]ations?": "organization", r"lock status": "lock_status"}
+    },
+    "LAN_DEVICES": {
+        "label": "LAN devices",
+        "pattern": r"\b(lan|dnac|campus) (devices?|switch(es)?|routers?|access points?)\b",
+        "display": ["hostname", "managementIPAddress"],
+        "metrics": {r"cpu": "cpuUsage", r"memory": "memoryUsage", r"health": "health"},
+        "states": {r"(unreachable|not reachable)": ("reachability", "eq", "Unreachable"),
+                   r"reachable": ("reachability", "eq", "Reachable")},
+        "groups": {r"types?": "type", r"(software )?versions?": "softwareVersion", r"reachability": "reachability"}
+    },
+    "WAN_DEVICES": {
+        "label": "WAN devices",
+        "pattern": r"\b(wan|sd-?wan|vmanage) (devices?|routers?|edges?)\b",
+        "display": ["host-name", "system-ip"],
+        "metrics": {r"memory": wan_memory_usage},
+        "states": {r"(unreachable|not reachable)": ("reachability", "eq", "unreachable"),
+                   r"reachable": ("reachability", "eq", "reachable")},
+        "groups": {r"(device )?types?": "device-type", r"versions?": "version", r"sites?": "site-id",
+                   r"status": "status"}
+    }
+}
+
+COMPARISONS = {
+    "gt": r"above|over|more than|greater than|higher than|exceeding|>",
+    "lt": r"below|under|less than|lower than|<"
+}
+
+# questions asking for reasons or advice need the LLM even when they name a KB section
+NON_QUERY_PATTERN = r"\b(why|explain|cause[sd]?|reasons?|should|recommend\w*|fix|troubleshoot\w*)\b|\bhow (?!many)"
+
+LIST_PATTERN = r"\b(list|show|which|what are|display|give me|find)\b"
+
+# words that only phrase the query, on top of the intent classifier's stopwords
+QUERY_WORDS = {"number", "total", "count", "usage", "utilisation", "utilization", "level", "percent", "currently",
+               "now", "network", "all", "every", "have", "has", "contain", "contains", "get"}
+
+
+class QueryRouter:
+    def __init__(self, max_rows):
+        """
+        Pattern-based router answering counting and lookup questions about a KB section locally, e.g. "how many LAN
+        devices are unreachable" or "which Knox phones contain malware". A question is only answered when every word
+        of it is understood, anything else falls through to the LLM.
+
+        :param max_rows: (int) maximum number of records listed in an answer
+        """
+        self.max_rows = max_rows
+        self.lock = Lock()
+        self.answered = 0
+
+    def answer(self, question, entity_spans, generation):
+        """
+        :param question: (str) question asked by the user
+        :param entity_spans: (list[]) (start, end, (entity, domain)) spans of the entities found in the question
+        :param generation: (KnowledgeBaseGeneration) KB snapshot to answer from
+        :return: (str) answer, or None if the question is not a plain query over one KB section
+        """
+        text = question.lower()
+        if re.search(NON_QUERY_PATTERN, text):
+            return None
+        # the section is routed on the question as asked, an entity such as vManage may also name the section
+        section = None
+        for name, spec in QUERY_SECTIONS.items():
+            found = re.search(spec["pattern"], text)
+            if found:
+                section = name
+                # a state word taken as part of the section name would be answered without its filter
+                if any(re.search(rf"\b{state}\b", found.group(0)) for state in spec["states"]):
+                    log.warning(f"KB Query: {name} pattern matched a state word in \"{found.group(0)}\".")
+                    return None
+                break
+        if section is None:
+            return None
+        spec = QUERY_SECTIONS[section]
+
+        # entities filter the records to those mentioning them, unless they are part of the section name as in
+        # "vmanage alarms". Both are blanked so that neither is read as a number, state or group below
+        entities = []
+        for start, end, (entity, domain) in entity_spans:
+            if not (found.start() <= start and end <= found.end()):
+                entities.append(entity)
+            text = text[:start] + " " * (end - start) + text[end:]
+        text = text[:found.start()] + " " * (found.end() - found.start()) + text[found.end():]
+        if entities:
+            # "connected to SW2" names the device the records mention, it is not a status
+            text, _ = self.consume(text=text, pattern=r"\b(connected|attached) (to|on)\b")
+
+        text, count = self.consume(text=text, pattern=r"\b(how many|number of|count( of)?|total)\b")
+        text, top = self.consume(text=text, pattern=r"\b(top|bottom) (\d+)\b")
+        text, listing = self.consume(text=text, pattern=LIST_PATTERN)
+        query = KBQuery(generation.section(section))
+        conditions = []
+
+        if entities:
+            mentioned = generation.entity_index.records(entities=entities, sections=generation.sections,
+                                                        section_names=[section]).get(section, [])
+            query = KBQuery(mentioned)
+            conditions.append("mentioning " + ", ".join(entities))
+
+        metric_fields = {}
+        for metric, field in spec["metrics"].items():
+            for op, comparison in COMPARISONS.items():
+                pattern = rf"\b(?P<metric>{metric})( usage| utili[sz]ation| level)?( is)? ({comparison}) " \
+                          rf"(?P<value>\d+(\.\d+)?) ?(%|percent)?(?!\w)"
+                text, found = self.consume(text=text, pattern=pattern)
+                if found:
+                    query = query.filter(field=field, op=op, value=found.group("value"))
+                    conditions.append(f"{found.group('metric')} {'above' if op == 'gt' else 'below'} "
+                                      f"{found.group('value')}")
+                    metric_fields[found.group("metric")] = field
+
+        for state, (field, op, value) in spec["states"].items():
+            text, found = self.consume(text=text, pattern=rf"\b{state}\b")
+            if found:
+                query = query.filter(field=field, op=op, value=value)
+                conditions.append(found.group(0).strip())
+
+        group_field = None
+        for group, field in spec["groups"].items():
+            text, found = self.consume(text=text, pattern=rf"\b(by|per|for each|each) {group}\b")
+            if found:
+                group_field = (found.group(0).split(" ", 1)[1], field)
+                break
+
+        top_field = None
+        if top:
+            for metric, field in spec["metrics"].items():
+                text, found = self.consume(text=text, pattern=rf"\b(by|with( the)? (highest|lowest|most))? ?{metric}\b")
+                if found:
+                    top_field = (found.group(0).split()[-1], field)
+                    break
+            if top_field is None:
+                return None
+
+        # any word left that the router did not consume may change the meaning, leave the question to the LLM
+        leftover = [word for word in re.findall(r"[a-z0-9%]+", text) if word not in STOPWORDS and
+                    word not in QUERY_WORDS and not word.isdigit()]
+        if leftover or not (count or top or listing or group_field):
+            return None
+
+        with self.lock:
+            self.answered += 1
+        log.info(f"KB Query: Answered locally from {section}.")
+        label = spec["label"]
+        condition_text = f" ({'; '.join(conditions)})" if conditions else ""
+        if group_field:
+            groups = query.group(field=group_field[1])
+            return f"{query.count()} {label}{condition_text} by {group_field[0]}:\n" + \
+                "\n".join(f"- {value}: {group_count}" for value, group_count in groups[:self.max_rows])
+        if top_field:
+            direction, k = top.group(1), int(top.group(2))
+            query = query.top(field=top_field[1], k=k, descending=direction == "top")
+            metric_fields[top_field[0]] = top_field[1]
+        if count and not top_field:
+            return f"{query.count()} {label} match{condition_text}." if conditions else \
+                f"There are {query.count()} {label}."
+        return self.render_list(query=query, spec=spec, condition_text=condition_text, metric_fields=metric_fields)
+
+    @staticmethod
+    def consume(text, pattern):
+        """
+        :return: (tuple) text with the first match of the pattern blanked out, and the match or None
+        """
+        found = re.search(pattern, text)
+        if not found:
+            return text, None
+        return text[:found.start()] + " " * (found.end() - found.start()) + text[found.end():], found
+
+    def render_list(self, query, spec, condition_text, metric_fields):
+        total = query.count()
+        if not total:
+            return f"No {spec['label']} match{condition_text}."
+        fields = {field: field for field in spec["display"]}
+        fields.update(metric_fields)
+        lines = []
+        for row in KBQuery(query.records[:self.max_rows]).project(fields=fields):
+            lines.append("- " + " | ".join(f"{value}" if name in spec["display"] else f"{name}: {value}"
+                                           for name, value in row.items() if value not in [None, ""]))
+        if total > self.max_rows:
+            lines.append(f"...and {total - self.max_rows} more.")
+        return f"{total} {spec['label']} match{condition_text}:\n" + "\n".join(lines)
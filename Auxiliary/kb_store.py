@@ -0,0 +1,219 @@
+# package import
+import hashlib
+import json
+import logging
+import os
+from itertools import count
+from threading import Event, Lock, Thread
+
+# local file import
+from Auxiliary.bm25_index import BM25Index
+from Auxiliary.entity_index import EntityIndex
+from Auxiliary.entity_matcher import build_entity_matcher
+from Auxiliary.kb_views import (
+    INTENT_SECTIONS,
+    build_entity_view,
+    build_intent_views,
+    make_view
+)
+from Storage.filepaths import (
+    bm25_index_filepath,
+    dnac_kb_filepath,
+    ise_kb_filepath,
+    knox_kb_filepath,
+    snam_kb_filepath,
+    vmanage_kb_filepath,
+    device_domain_map_filepath
+)
+
+logging.basicConfig()
+log = logging.getLogger("KB_Store_Operation")
+log.setLevel(logging.INFO)
+
+# controller KB files whose top-level keys are the sections served to the chatbot
+KB_SECTION_FILEPATHS = [
+    dnac_kb_filepath,
+    vmanage_kb_filepath,
+    ise_kb_filepath,
+    knox_kb_filepath,
+    snam_kb_filepath
+]
+
+
+class KnowledgeBaseGeneration:
+    def __init__(self, generation_id, files, mtimes, previous=None):
+        """
+        Immutable snapshot of every KB file at a point in time. A new generation is built whenever any file changes on
+        disk, and parsed files that did not change are shared with the previous generation rather than re-read.
+
+        :param generation_id: (int) monotonically increasing identifier of this snapshot
+        :param files: (dict{}) filepath mapped to the parsed json content of that file
+        :param mtimes: (dict{}) filepath mapped to the modification time the content was read at
+        :param previous: (KnowledgeBaseGeneration) generation this one replaces, whose section digests are reused for
+        files that were not reloaded
+        """
+        self.generation_id = generation_id
+        self.files = files
+        self.mtimes = mtimes
+
+        self.sections = {}
+        for filepath in KB_SECTION_FILEPATHS:
+            self.sections.update(files.get(filepath) or {})
+        self.device_domain_mapping = files.get(device_domain_map_filepath) or {}
+        # content digest per section, so caches can tell which sections a refresh actually changed
+        self.section_digests = {}
+        for name, records in self.sections.items():
+            if previous is not None and previous.sections.get(name) is records:
+                self.section_digests[name] = previous.section_digests[name]
+            else:
+                self.section_digests[name] = hashlib.sha1(json.dumps(records, sort_keys=True).encode()).hexdigest()
+        # lexical retrieval index over every record, persisted next to the KB files and reused across restarts
+        self.bm25_index = None
+        if self.sections:
+            kb_digest = hashlib.sha1("|".join(f"{name}:{digest}" for name, digest in
+                                              sorted(self.section_digests.items())).encode()).hexdigest()
+            self.bm25_index = BM25Index.load_or_build(filepath=bm25_index_filepath, sections=self.sections,
+                                                      digest=kb_digest)
+        # serialised CI per intent category, built once here rather than on every question
+        self.views = build_intent_views(sections=self.sections)
+        # cross-domain index of every entity and the records mentioning it, rebuilt with each generation
+        self.entity_index = EntityIndex(sections=self.sections)
+        # multi-pattern matcher over every indexed device name, address and serial of this generation
+        self.entity_matcher = build_entity_matcher(entity_index=self.entity_index,
+                                                   device_domain_mapping=self.device_domain_mapping)
+
+    def section(self, name):
+        """
+        :param name: (str) KB section name, e.g. LAN_DEVICES, WAN_ISSUES, AUTHORIZATION_POLICIES
+        :return: (list[]) records of the section, or an empty list if the section has not been collected yet
+        """
+        return self.sections.get(name, [])
+
+    def view(self, intent):
+        """
+        :param intent: (str) intent category name, e.g. LAN_DEVICES, OVERALL_ISSUES
+        :return: (IntentView) materialised CI of the intent, or None if the intent has no KB sections
+        """
+        return self.views.get(intent)
+
+    def intent_digest(self, intent):
+        """
+        :param intent: (str) intent category name
+        :return: (str) digest of the KB sections the intent's CI is built from, which changes only when one of those
+        sections is regenerated with different content
+        """
+        digests = [self.section_digests.get(section, "") for section, domain in INTENT_SECTIONS.get(intent, [])]
+        return hashlib.sha1("|".join(digests).encode()).hexdigest()
+
+    def retrieval_view(self, intent, question, k):
+        """
+        :param intent: (str) intent category name
+        :param question: (str) question asked by the user
+        :param k: (int) number of records to retrieve
+        :return: (IntentView) CI made of the intent's top-k records by BM25 score, or None if nothing matched
+        """
+        section_domains = dict(INTENT_SECTIONS.get(intent, []))
+        if self.bm25_index is None or not section_domains:
+            return None
+        hits = self.bm25_index.search(query=question, k=k, sections=section_domains)
+        if not hits:
+            return None
+        records = []
+        for section, position, score in hits:
+            record = self.sections[section][position]
+            if section_domains[section] is not None and type(record) == dict:
+                record = {**record, "domain": section_domains[section]}
+            records.append(record)
+        return make_view(intent=intent, records=records)
+
+    def entity_view(self, intent, entities):
+        """
+        :param intent: (str) intent category name
+        :param entities: (list[]) entity values found in the question
+        :return: (IntentView) CI of the intent restricted to records mentioning the entities, or None if there are none
+        """
+        if not entities:
+            return None
+        return build_entity_view(intent=intent, entity_index=self.entity_index, sections=self.sections,
+                                 entities=entities)
+
+
+class KnowledgeBaseStore:
+    def __init__(self, filepaths=None, poll_interval=5):
+        self.filepaths = filepaths if filepaths else KB_SECTION_FILEPATHS + [device_domain_map_filepath]
+        self.poll_interval = poll_interval
+        self.lock = Lock()
+        self.generation_ids = count(start=1)
+        self.generation = KnowledgeBaseGeneration(generation_id=0, files={}, mtimes={})
+        self.stop_event = Event()
+        self.watcher = None
+        self.refresh()
+
+    def current(self):
+        """
+        Return the KB generation currently being served. Reading the attribute is atomic, so callers always see a
+        complete generation even while a refresh is swapping in a new one.
+        :return: (KnowledgeBaseGeneration) current KB snapshot
+        """
+        return self.generation
+
+    def refresh(self):
+        """
+        Re-read the KB files whose mtime changed since the current generation was built, and atomically swap in a new
+        generation if anything changed. A file that cannot be parsed (e.g. a controller is mid-write) keeps its previous
+        content and is retried on the next refresh.
+        :return: (KnowledgeBaseGeneration) generation being served after the refresh
+        """
+        with self.lock:
+            previous = self.generation
+            files = dict(previous.files)
+            mtimes = dict(previous.mtimes)
+            changed = []
+
+            for filepath in self.filepaths:
+                try:
+                    mtime = os.path.getmtime(filepath)
+                except OSError:
+                    continue
+                if mtimes.get(filepath) == mtime:
+                    continue
+                try:
+                    with open(filepath, "r") as file:
+                        files[filepath] = json.load(file)
+                    mtimes[filepath] = mtime
+                    changed.append(os.path.basename(filepath))
+                except Exception as e:
+                    log.error(f"KB Store Refresh: Unable to load {filepath}, keeping previous content. Error: {e}")
+
+            if changed:
+                self.generation = KnowledgeBaseGeneration(
+                    generation_id=next(self.generation_ids),
+                    files=files,
+                    mtimes=mtimes,
+                    previous=previous
+                )
+                log.info(f"KB Store Refresh: Generation {self.generation.generation_id} loaded. Changed: {changed}")
+
+            return self.generation
+
+    def watch(self):
+        """
+        Start a daemon thread that polls the KB files for changes every poll_interval seconds. Controllers may also
+        call refresh() directly after writing their KB to have the change picked up immediately.
+        """
+        if self.watcher and self.watcher.is_alive():
+            return
+
+        def poll():
+            while not self.stop_event.wait(timeout=self.poll_interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    log.error(f"KB Store Watcher: Unknown exception: Deeper troubleshooting required to fix {e}")
+
+        self.stop_event.clear()
+        self.watcher = Thread(target=poll, name="KB_Store_Watcher", daemon=True)
+        self.watcher.start()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,219 @@
+# package import
+import datetime
+import json
+import logging
+
+# local file import
+from Auxiliary.ci_ranker import (
+    record_timestamp,
+    select_ci
+)
+from Auxiliary.kb_views import make_view
+
+logging.basicConfig()
+log = logging.getLogger("KB_Tools_Operation")
+log.setLevel(logging.INFO)
+
+# functions the LLM may call, in the chat completion "tools" format
+TOOL_DEFINITIONS = {
+    "get_device": {
+        "description": "Get the inventory record of a network device or Samsung Knox phone, including its modules and "
+                       "interfaces.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "hostname": {
+                    "type": "string",
+                    "description": "Hostname, management IP address, serial number or Knox model of the device."
+                }
+            },
+            "required": ["hostname"]
+        }
+    },
+    "get_interfaces": {
+        "description": "Get the interfaces of a LAN or WAN network device.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "hostname": {
+                    "type": "string",
+                    "description": "Hostname of the device."
+                }
+            },
+            "required": ["hostname"]
+        }
+    },
+    "list_issues": {
+        "description": "List open issues and alarms. Only WAN issues carry a severity.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "domain": {
+                    "type": "string",
+                    "enum": ["LAN", "WAN", "STEALTHWATCH", "ALL"],
+                    "description": "Domain of the issues."
+                },
+                "severity": {
+                    "type": "string",
+                    "description": "Only return issues of this severity, e.g. Critical."
+                },
+                "since": {
+                    "type": "string",
+                    "description": "Only return issues that occurred on or after this date, as DD/MM/YYYY."
+                }
+            },
+            "required": ["domain"]
+        }
+    },
+    "get_clients": {
+        "description": "List the LAN clients connected to a network device, or every LAN client if no device is given.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "device": {
+                    "type": "string",
+                    "description": "Hostname or IP address of the network device the clients connect to."
+                }
+            },
+            "required": []
+        }
+    },
+    "get_policy": {
+        "description": "Get ISE authentication and authorization policies whose name contains the given text.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "name": {
+                    "type": "string",
+                    "description": "Full or partial policy name."
+                }
+            },
+            "required": ["name"]
+        }
+    }
+}
+
+# intent category mapped to the tools offered when answering it, intents without tools are answered from their CI
+INTENT_TOOLS = {
+    "LAN_DEVICES": ["get_device", "get_interfaces"],
+    "LAN_INTERFACES": ["get_interfaces", "get_device"],
+    "LAN_CLIENTS": ["get_clients", "get_device"],
+    "LAN_ISSUES": ["list_issues", "get_device"],
+    "WAN_DEVICES": ["get_device", "get_interfaces"],
+    "WAN_INTERFACES": ["get_interfaces", "get_device"],
+    "WAN_ISSUES": ["list_issues", "get_device"],
+    "ISE_AUTHENTICATION": ["get_policy"],
+    "ISE_AUTHORIZATION": ["get_policy"],
+    "STEALTHWATCH_ISSUES": ["list_issues"],
+    "KNOX_DEVICES": ["get_device"],
+    "OVERALL_ISSUES": ["list_issues", "get_device"]
+}
+
+ISSUE_SECTIONS = {
+    "LAN": "LAN_ISSUES",
+    "WAN": "WAN_ISSUES",
+    "STEALTHWATCH": "STEALTHWATCH_ALARMS"
+}
+
+
+def intent_tools(intent):
+    """
+    :param intent: (str) intent category name
+    :return: (list[]) tool definitions offered for the intent, in the chat completion "tools" format
+    """
+    return [{"type": "function", "function": {"name": name, **TOOL_DEFINITIONS[name]}}
+            for name in INTENT_TOOLS.get(intent, [])]
+
+
+def parse_date(value):
+    for date_format in ["%d/%m/%Y", "%Y-%m-%d", "%d/%m/%Y, %H:%M:%S"]:
+        try:
+            return datetime.datetime.strptime(value.strip(), date_format).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+class KBTools:
+    def __init__(self, generation, intent, question, entities, token_budget):
+        """
+        Local functions the LLM calls to pull exact slices of the in-memory KB, so the prompt grows with what the
+        answer needs rather than with the size of the estate. Results are encoded like the intent's CI and packed
+        within the same token budget.
+
+        :param generation: (KnowledgeBaseGeneration) KB snapshot the functions read from
+        :param intent: (str) intent category of the question
+        :param question: (str) question asked by the user, used to rank results that exceed the budget
+        :param entities: (list[]) entity values found in the question
+        :param token_budget: (int) maximum estimated tokens of one function result
+        """
+        self.generation = generation
+        self.intent = intent
+        self.question = question
+        self.entities = entities
+        self.token_budget = token_budget
+
+    def call(self, name, arguments):
+        """
+        :param name: (str) function name requested by the LLM
+        :param arguments: (str) json-encoded arguments requested by the LLM
+        :return: (str) function result to send back to the LLM
+        """
+        if name not in INTENT_TOOLS.get(self.intent, []):
+            return f"Unknown function {name}."
+        try:
+            records = getattr(self, name)(**json.loads(arguments or "{}"))
+        except Exception as e:
+            log.error(f"KB Tools: {name}({arguments}) Unsuccessful. Error: {e}")
+            return f"Function {name} failed: {e}"
+        log.info(f"KB Tools: {name}({arguments}) returned {len(records)} records.")
+        view = make_view(intent=self.intent, records=records)
+        return f"{len(records)} record(s) found.\n" + select_ci(view=view, question=self.question,
+                                                                 entities=self.entities,
+                                                                 token_budget=self.token_budget)
+
+    def entity_records(self, value, section_names):
+        return self.generation.entity_index.records(entities=[value], sections=self.generation.sections,
+                                                    section_names=section_names)
+
+    def get_device(self, hostname):
+        sections = self.entity_records(value=hostname,
+                                       section_names=["LAN_DEVICES", "WAN_DEVICES", "SAMSUNG_DEVICES"])
+        return [record for records in sections.values() for record in records]
+
+    def get_interfaces(self, hostname):
+        return [record for section in ["LAN_INTERFACES", "WAN_INTERFACES"]
+                for record in self.generation.section(section)
+                if str(record.get("hostname", "")).lower() == hostname.strip().lower()]
+
+    def list_issues(self, domain, severity=None, since=None):
+        domains = list(ISSUE_SECTIONS) if domain.upper() == "ALL" else [domain.upper()]
+        since_timestamp = parse_date(since) if since else None
+        issues = []
+        for issue_domain in domains:
+            for record in self.generation.section(ISSUE_SECTIONS.get(issue_domain, "")):
+                if severity and "severity" in record and \
+                        str(record["severity"]).lower() != severity.strip().lower():
+                    continue
+                if since_timestamp is not None and (record_timestamp(record) or 0) < since_timestamp:
+                    continue
+                # tag copies, the section records are shared with the KB generation
+                issues.append({**record, "domain": issue_domain} if len(domains) > 1 else record)
+        return issues
+
+    def get_clients(self, device=None):
+        clients = self.generation.section("LAN_CLIENTS")
+        if not device:
+            return clients
+        device = device.strip().lower()
+        return [client for client in clients
+                if device in [str(client.get("connected_device_hostname")).lower(),
+                              str(client.get("connected_device_ip")).lower()]]
+
+    def get_policy(self, name):
+        name = name.strip().lower()
+        return [{**policy, "policy_type": policy_type}
+                for section, policy_type in [("AUTHENTICATION_POLICIES", "authentication"),
+                                             ("AUTHORIZATION_POLICIES", "authorization")]
+                for policy in self.generation.section(section)
+                if name in str(policy.get("name", "")).lower()]
@@ -0,0 +1,252 @@
+# package import
+import json
+import logging
+
+# local file import
+from Auxiliary.helper import estimate_tokens
+
+logging.basicConfig()
+log = logging.getLogger("KB_View_Generation")
+log.setLevel(logging.INFO)
+
+# intent category mapped to the KB sections that make up its CI, as (section, domain tag) tuples. a domain tag is added
+# to each record when sections from several controllers are merged into one CI.
+INTENT_SECTIONS = {
+    "LAN_DEVICES": [("LAN_DEVICES", None)],
+    "LAN_INTERFACES": [("LAN_INTERFACES", None)],
+    "LAN_CLIENTS": [("LAN_CLIENTS", None)],
+    "LAN_ISSUES": [("LAN_ISSUES", None)],
+    "WAN_DEVICES": [("WAN_DEVICES", None)],
+    "WAN_INTERFACES": [("WAN_INTERFACES", None)],
+    "WAN_ISSUES": [("WAN_ISSUES", None)],
+    "ISE_AUTHENTICATION": [("AUTHENTICATION_POLICIES", None)],
+    "ISE_AUTHORIZATION": [("AUTHORIZATION_POLICIES", None)],
+    "STEALTHWATCH_ISSUES": [("STEALTHWATCH_ALARMS", None)],
+    "KNOX_DEVICES": [("SAMSUNG_DEVICES", None)],
+    "OVERALL_ISSUES": [("LAN_ISSUES", "LAN"), ("WAN_ISSUES", "WAN")]
+}
+
+# intent category mapped to the encoding of its CI, "json" (default) or "table". tables send each key once in a header
+# row instead of once per record, which pays off on sections of many records sharing the same keys.
+INTENT_ENCODINGS = {
+    "LAN_INTERFACES": "table",
+    "LAN_CLIENTS": "table",
+    "LAN_ISSUES": "table",
+    "WAN_INTERFACES": "table",
+    "WAN_ISSUES": "table",
+    "OVERALL_ISSUES": "table"
+}
+
+TABLE_FORMAT = "format: one record per line, fields separated by |, list items separated by ;, empty field = null"
+
+
+class IntentView:
+    def __init__(self, intent, records):
+        """
+        Ready-to-send CI for one intent category, serialised once per KB generation instead of once per question.
+
+        :param intent: (str) intent category name
+        :param records: (list[]) KB records making up the CI of the intent
+        """
+        self.intent = intent
+        self.records = records
+        self.rows = self.serialise(records=records)
+        self.row_tokens = [estimate_tokens(row) for row in self.rows]
+        # tokens sent whatever records are selected, e.g. the brackets of the json array
+        self.overhead_tokens = 2
+        # identical to json.dumps(records, sort_keys=True), assembled from the per-record rows
+        self.payload = self.render(positions=range(len(self.rows)))
+        # overhead plus one separator between records
+        self.tokens = self.overhead_tokens + sum(self.row_tokens) + max(len(self.rows) - 1, 0)
+        # per-record relevance features, computed by the CI ranker the first time this view is ranked
+        self.ranking_features = None
+        # canonical json of each record mapped to its position, computed the first time retrieved records are packed
+        self.record_positions = None
+
+    def serialise(self, records):
+        """
+        :param records: (list[]) KB records making up the CI of the intent
+        :return: (list[]) serialised record rows
+        """
+        # keys are sorted so that the same records always serialise to the same text, keeping prompts cacheable
+        return [json.dumps(record, sort_keys=True) for record in records]
+
+    def render(self, positions):
+        """
+        :param positions: (list[]) positions of the records to include, in the order they should appear
+        :return: (str) json array of the selected records
+        """
+        return "[" + ", ".join(self.rows[position] for position in positions) + "]"
+
+
+def cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace("\n", " ").replace("|", "/")
+
+
+def flatten_record(record, prefix=""):
+    """
+    Flatten a KB record into table cells. Nested dicts become dotted columns, lists of scalars become one cell, and
+    lists of dicts become one column per nested key whose cells list the items' values in the same order.
+    :param record: (dict{}) KB record
+    :param prefix: (str) dotted path of the record within its parent
+    :return: (dict{}) column mapped to cell text
+    """
+    cells = {}
+    for key, value in record.items():
+        column = prefix + key
+        if isinstance(value, dict):
+            cells.update(flatten_record(record=value, prefix=column + "."))
+        elif isinstance(value, list) and any(isinstance(item, dict) for item in value):
+            nested_keys = []
+            for item in value:
+                for nested_key in item if isinstance(item, dict) else []:
+                    if nested_key not in nested_keys:
+                        nested_keys.append(nested_key)
+            for nested_key in nested_keys:
+                cells[f"{column}.{nested_key}"] = ";".join(
+                    cell_text(item.get(nested_key)) if isinstance(item, dict) else "" for item in value)
+        elif isinstance(value, list):
+            # an empty list is left out, its cell is empty like a null
+            if value:
+                cells[column] = ";".join(cell_text(item) for item in value)
+        else:
+            cells[column] = cell_text(value)
+    return cells
+
+
+class TableView(IntentView):
+    def __init__(self, intent, records):
+        """
+        CI serialised as a header row plus one delimiter-separated row per record, sending every key once instead of
+        once per record. Nested lists are flattened into columns, and the parents of nested columns are abbreviated in
+        the header and spelt out in a short legend.
+
+        :param intent: (str) intent category name
+        :param records: (list[]) KB records making up the CI of the intent
+        """
+        self.header = ""
+        super().__init__(intent=intent, records=records)
+        self.overhead_tokens = estimate_tokens(self.header) + 1
+        self.tokens = self.overhead_tokens + sum(self.row_tokens) + len(self.rows)
+        # size of the same CI as a json array, to report the saving of the table encoding
+        self.json_tokens = IntentView(intent=intent, records=records).tokens
+
+    def serialise(self, records):
+        cell_rows = [flatten_record(record=record if isinstance(record, dict) else {"value": record})
+                     for record in records]
+        # columns in a fixed order, whatever order the controllers returned the keys in
+        columns = sorted({column for cells in cell_rows for column in cells})
+
+        # abbreviate the parent of nested columns, e.g. "interfaces.portName" to "i.portName"
+        aliases = {}
+        for column in columns:
+            parent = column.split(".")[0]
+            if "." in column and parent not in aliases:
+                alias = parent[0].lower()
+                while alias in aliases.values() or alias in columns:
+                    alias = parent[:len(alias) + 1].lower() if len(alias) < len(parent) else alias + "_"
+                aliases[parent] = alias
+        header_columns = [aliases[column.split(".")[0]] + column[column.index("."):] if "." in column else column
+                          for column in columns]
+
+        header_lines = [TABLE_FORMAT]
+        if aliases:
+            header_lines.append("legend: " + ", ".join(f"{alias}={parent}" for parent, alias in aliases.items()))
+        header_lines.append("|".join(header_columns))
+        self.header = "\n".join(header_lines)
+        return ["|".join(cells.get(column, "") for column in columns) for cells in cell_rows]
+
+    def render(self, positions):
+        positions = list(positions)
+        if not positions:
+            return "[]"
+        return self.header + "\n" + "\n".join(self.rows[position] for position in positions)
+
+
+def make_view(intent, records):
+    """
+    :param intent: (str) intent category name
+    :param records: (list[]) KB records making up the CI of the intent
+    :return: (IntentView) CI of the intent in the encoding configured in INTENT_ENCODINGS
+    """
+    if records and INTENT_ENCODINGS.get(intent) == "table":
+        return TableView(intent=intent, records=records)
+    return IntentView(intent=intent, records=records)
+
+
+def intent_records(intent, sections):
+    """
+    Assemble the CI records of an intent from its KB sections, tagging records with their domain where needed.
+    :param intent: (str) intent category name
+    :param sections: (dict{}) KB section name mapped to its list of records
+    :return: (list[]) CI records of the intent
+    """
+    records = []
+    for section, domain in INTENT_SECTIONS.get(intent, []):
+        section_records = sections.get(section, [])
+        if domain is not None:
+            # tag copies, the section records are shared by every generation that did not reload the file
+            section_records = [{**record, "domain": domain} if type(record) == dict else record
+                               for record in section_records]
+        # records in a stable order, so that a refresh returning the same records in another order renders the same CI
+        records.extend(sorted(section_records, key=lambda record: json.dumps(record, sort_keys=True)))
+    return records
+
+
+def build_intent_views(sections):
+    """
+    Slice, tag and serialise the CI of every intent category from the sections of a KB generation.
+    :param sections: (dict{}) KB section name mapped to its list of records
+    :return: (dict{}) intent category mapped to its IntentView
+    """
+    views = {}
+    for intent in INTENT_SECTIONS:
+        views[intent] = make_view(intent=intent, records=intent_records(intent=intent, sections=sections))
+
+    if sections:
+        log.info("KB View Generation: CI tokens per intent: " +
+                 ", ".join(f"{intent}={view.tokens}" for intent, view in views.items()))
+        savings = encoding_savings(views=views)
+        if savings:
+            log.info("KB View Generation: Table encoding savings: " +
+                     ", ".join(f"{intent}={saving['json_tokens']}->{saving['table_tokens']} "
+                               f"(-{saving['saving']:.0%})" for intent, saving in savings.items()))
+    return views
+
+
+def encoding_savings(views):
+    """
+    :param views: (dict{}) intent category mapped to its IntentView
+    :return: (dict{}) table-encoded intent mapped to its json and table token counts and the relative saving
+    """
+    savings = {}
+    for intent, view in views.items():
+        if isinstance(view, TableView):
+            savings[intent] = {
+                "json_tokens": view.json_tokens,
+                "table_tokens": view.tokens,
+                "saving": round(1 - view.tokens / view.json_tokens, 3) if view.json_tokens else 0.0
+            }
+    return savings
+
+
+def build_entity_view(intent, entity_index, sections, entities):
+    """
+    Build the CI of an intent from only the records that mention the entities in the question.
+    :param intent: (str) intent category name
+    :param entity_index: (EntityIndex) cross-domain entity index of the KB generation
+    :param sections: (dict{}) KB section name mapped to its list of records
+    :param entities: (list[]) entity values found in the question
+    :return: (IntentView) entity-scoped CI, or None if no record of the intent's sections mentions the entities
+    """
+    section_names = [section for section, domain in INTENT_SECTIONS.get(intent, [])]
+    entity_sections = entity_index.records(entities=entities, sections=sections, section_names=section_names)
+    if not entity_sections:
+        return None
+    return make_view(intent=intent, records=intent_records(intent=intent, sections=entity_sections))
@@ -0,0 +1,79 @@
+# package import
+import math
+import time
+from collections import deque
+from threading import Lock
+
+
+def percentile(values, rank):
+    """
+    :param values: (list[]) samples
+    :param rank: (float) percentile between 0 and 100
+    :return: (float) nearest-rank percentile of the samples, or None if there are none
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+class LatencyTracker:
+    def __init__(self, window):
+        """
+        Sliding window of the most recent latency samples per series, e.g. one series per pipeline stage.
+
+        :param window: (int) number of recent samples kept per series
+        """
+        self.window = window
+        self.lock = Lock()
+        self.samples = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name, rank, min_samples=1):
+        """
+        :param name: (str) series name
+        :param rank: (float) percentile between 0 and 100
+        :param min_samples: (int) samples needed before the percentile is trusted
+        :return: (float) percentile of the series in seconds, or None if it has fewer than min_samples samples
+        """
+        with self.lock:
+            values = list(self.samples.get(name, []))
+        return percentile(values=values, rank=rank) if len(values) >= min_samples else None
+
+    def summary(self, name):
+        with self.lock:
+            values = list(self.samples.get(name, []))
+        return {"samples": len(values), **{f"p{rank}": round(percentile(values=values, rank=rank), 3) if values else None
+                                           for rank in [50, 95, 99]}}
+
+    def names(self):
+        with self.lock:
+            return list(self.samples)
+
+
+class MinuteBudget:
+    def __init__(self, per_minute):
+        """
+        Allowance of at most per_minute uses over any sliding minute.
+
+        :param per_minute: (int) uses allowed per minute
+        """
+        self.per_minute = per_minute
+        self.lock = Lock()
+        self.used = deque()
+
+    def acquire(self):
+        """
+        :return: (bool) True if a use was taken from the budget, False if the minute's budget is spent
+        """
+        with self.lock:
+            now = time.time()
+            while self.used and now - self.used[0] >= 60:
+                self.used.popleft()
+            if len(self.used) >= self.per_minute:
+                return False
+            self.used.append(now)
+            return True
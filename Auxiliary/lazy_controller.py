@@ -0,0 +1,39 @@
+# package import
+import logging
+from threading import Lock
+from time import perf_counter
+
+logging.basicConfig()
+log = logging.getLogger("Lazy_Controller_Operation")
+log.setLevel(logging.INFO)
+
+
+class LazyController:
+    def __init__(self, name, factory):
+        """
+        Defer the construction of an SDN controller object, i.e. its authentication and any set-up calls, until it is
+        first needed. A construction that fails is retried on the next use instead of stopping the program.
+
+        :param name: (str) controller name used in log messages, e.g. DNAC
+        :param factory: (function) builds the controller object, e.g. the DNAC class
+        """
+        self.name = name
+        self.factory = factory
+        self.lock = Lock()
+        self.instance = None
+
+    def get(self):
+        """
+        :return: controller object, or None if it could not be constructed
+        """
+        with self.lock:
+            if self.instance is None:
+                start = perf_counter()
+                try:
+                    self.instance = self.factory()
+                    log.info(f"{self.name} Authentication: Ready in {perf_counter() - start:.2f}s.")
+                # controller constructors call exit() on failure, which must not end the thread they run in. Ctrl+C
+                # still stops the bot.
+                except (SystemExit, Exception) as e:
+                    log.error(f"{self.name} Authentication: Unsuccessful, retrying on next use. Error: {e!r}")
+            return self.instance
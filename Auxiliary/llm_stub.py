@@ -0,0 +1,151 @@
+# package import
+import argparse
+import json
+import logging
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+# local file import
+from Auxiliary.helper import (
+    estimate_tokens,
+    truncate_to_tokens
+)
+
+# words of the question quoted in a reply, so every reply stays short whatever the prompt
+REPLY_WORDS = 12
+
+logging.basicConfig()
+log = logging.getLogger("LLM_Stub_Operation")
+log.setLevel(logging.INFO)
+
+
+def message_text(messages):
+    # the intent prompt is sent as a json-encoded message, decoded here so its categories can be read
+    text = str(messages[-1].get("content") or "") if messages else ""
+    try:
+        decoded = json.loads(text)
+        if isinstance(decoded, dict) and decoded.get("content"):
+            return str(decoded["content"])
+    except ValueError:
+        pass
+    return text
+
+
+def stub_reply(messages):
+    """
+    Deterministic reply to a chat completion request: the same messages always get the same reply, of a bounded size
+    whatever the prompt, so that replies fed into later prompts (map-reduce facts, summaries) do not grow them.
+    :param messages: (list[]) chat messages of the request
+    :return: (str) intent category for intent prompts, otherwise a canned answer quoting the first REPLY_WORDS words
+    of the question and naming the CI size
+    """
+    text = message_text(messages=messages)
+    categories = re.findall(r'"category": "([^"]+)", "description": "((?:[^"\\]|\\.)*)"', text)
+    # the question follows the last "User Input:" wherever it appears, e.g. "Part 2 of 8. User Input: ...". Prompts
+    # without one, such as summary requests, are quoted from their start.
+    question = re.split(r"\b(?:User Input|Input|Question):", text)[-1].strip()
+    if categories:
+        # intent prompt: the category whose description shares the most words with the question
+        words = set(re.findall(r"[a-z]+", question.lower()))
+        scores = [(len(words & set(re.findall(r"[a-z]+", description.lower()))), category)
+                  for category, description in categories]
+        return max(scores, key=lambda score: score[0])[1]
+    # the CI is sent ahead of the question, either in the same message or in a context message of its own
+    context = "".join(str(message.get("content") or "") for message in messages[:-1] if message.get("role") == "system"
+                      and "Controller Information:" in str(message.get("content") or ""))
+    ci_tokens = estimate_tokens(context + text) - estimate_tokens(question)
+    quoted = " ".join(question.split()[:REPLY_WORDS])
+    return f"Stub answer to \"{quoted}\" from {ci_tokens} tokens of controller information."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    model = "networkgpt-stub"
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(status=200, body={"object": "list", "data": [{"id": self.model, "object": "model"}]})
+        else:
+            self.send_json(status=404, body={"error": {"message": "Not found."}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(status=404, body={"error": {"message": "Not found."}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages") or []
+        reply = stub_reply(messages=messages)
+        if request.get("max_tokens"):
+            reply = truncate_to_tokens(text=reply, max_tokens=request["max_tokens"])
+        usage = {
+            "prompt_tokens": estimate_tokens(json.dumps(messages)),
+            "completion_tokens": estimate_tokens(reply),
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion = {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                      "model": request.get("model") or self.model}
+        time.sleep(self.latency)
+
+        if not request.get("stream"):
+            self.send_json(status=200, body={**completion, "usage": usage, "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }]})
+            return
+
+        # server-sent events, one word per chunk, then the usage if it was asked for
+        events = [{**completion, "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                  for word in re.findall(r"\s*\S+", reply)]
+        if (request.get("stream_options") or {}).get("include_usage"):
+            events.append({**completion, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        content = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        content = content.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve(port, latency=0.0, model="networkgpt-stub", block=False):
+    """
+    Start the deterministic stub of the chat completion API, so the bot can run and be benchmarked offline.
+    :param port: (int) local port to listen on
+    :param latency: (float) seconds each completion takes
+    :param model: (str) model name reported by the stub
+    :param block: (bool) True to serve on the calling thread, False to serve on a daemon thread
+    :return: (ThreadingHTTPServer) running server
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"model": model, "latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    log.info(f"LLM Stub: Serving on http://127.0.0.1:{port}/v1 with {latency}s latency.")
+    if block:
+        server.serve_forever()
+    else:
+        Thread(target=server.serve_forever, name="LLM_Stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stub of the chat completion API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    arguments = parser.parse_args()
+    serve(port=arguments.port, latency=arguments.latency, block=True)
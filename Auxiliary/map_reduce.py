@@ -0,0 +1,140 @@
+# package import
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# local file import
+from Auxiliary.helper import normalise_question
+
+logging.basicConfig()
+log = logging.getLogger("Map_Reduce_Operation")
+log.setLevel(logging.INFO)
+
+# reply of a chunk without facts relevant to the question, left out of the merge
+NO_FACTS = "NONE"
+
+
+def chunk_positions(view, token_budget):
+    """
+    Split the records of a view into consecutive chunks whose rendered CI fits the token budget.
+    :param view: (IntentView) CI of the intent
+    :param token_budget: (int) maximum estimated tokens of one chunk, including the view's overhead
+    :return: (list[]) lists of record positions, one per chunk. A record larger than the budget gets a chunk of its own.
+    """
+    chunks = []
+    chunk = []
+    tokens = view.overhead_tokens
+    for position, row_tokens in enumerate(view.row_tokens):
+        if chunk and tokens + row_tokens + 1 > token_budget:
+            chunks.append(chunk)
+            chunk = []
+            tokens = view.overhead_tokens
+        chunk.append(position)
+        tokens += row_tokens + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class MapReduceSummariser:
+    def __init__(self, llm, chunk_tokens, max_chunks, max_workers, max_entries):
+        """
+        Map step of map-reduce answers over CI far larger than the token budget. The CI is split into chunks that each
+        fit the budget, and the facts relevant to the question are extracted from every chunk concurrently, so the time
+        taken is bounded by concurrency rather than by the size of the data. Chunk summaries are cached on the content
+        of the chunk, so they stay valid until a KB generation changes the records in that chunk.
+
+        :param llm: (LLMClient) client the extraction requests are sent with
+        :param chunk_tokens: (int) maximum estimated tokens of CI per chunk
+        :param max_chunks: (int) maximum number of chunks of one question, larger CI is not summarised
+        :param max_workers: (int) maximum number of concurrent extraction requests
+        :param max_entries: (int) number of chunk summaries kept before the least recently used one is evicted
+        """
+        self.llm = llm
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max_chunks
+        self.max_entries = max_entries
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Map_Reduce")
+        self.lock = Lock()
+        self.summaries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.answers = 0
+
+    def cached(self, key):
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self.summaries.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def store(self, key, summary):
+        with self.lock:
+            self.summaries[key] = summary
+            self.summaries.move_to_end(key)
+            while len(self.summaries) > self.max_entries:
+                self.summaries.popitem(last=False)
+
+    def extract(self, system, question, ci, number, total, room_id):
+        user_prompt = f"""Read my question and the part of the controller information (ci) below. Extract every fact
+            from this part that is relevant to the question, keeping device names, addresses, times and exact counts
+            for this part. Do not answer from other knowledge. If this part holds nothing relevant, reply only with
+            {NO_FACTS}.\nCI: {ci} \nPart {number} of {total}. User Input: {question} """
+        return self.llm.complete(messages=[{"role": "system", "content": system},
+                                           {"role": "user", "content": user_prompt}], stage="extract",
+                                 room_id=room_id)
+
+    def summarise(self, view, question, system, room_id=None):
+        """
+        :param view: (IntentView) CI of the intent, over the token budget
+        :param question: (str) question asked by the user
+        :param system: (str) system prompt of the extraction requests
+        :param room_id: (str) Webex room the question was asked in, or None
+        :return: (list[]) facts extracted from each chunk holding relevant ones, or None if the CI has more than
+        max_chunks chunks or an extraction request failed
+        """
+        chunks = chunk_positions(view=view, token_budget=self.chunk_tokens)
+        if len(chunks) > self.max_chunks:
+            log.info(f"Map Reduce: {view.intent} CI needs {len(chunks)} chunks, over the limit of {self.max_chunks}.")
+            return None
+
+        # equivalent questions share summaries
+        cache_question = normalise_question(question=question)
+        summaries = {}
+        futures = {}
+        for number, positions in enumerate(chunks, start=1):
+            ci = view.render(positions=positions)
+            # the part number is in the extract prompt, so the same chunk at another position is another request
+            key = hashlib.sha1(f"{cache_question}|{number}/{len(chunks)}|{ci}".encode()).hexdigest()
+            summary = self.cached(key)
+            if summary is not None:
+                summaries[number] = summary
+                continue
+            futures[number] = (key, self.pool.submit(self.extract, system, question, ci, number, len(chunks), room_id))
+
+        for number, (key, future) in futures.items():
+            summary = future.result()
+            if summary is None:
+                log.error(f"Map Reduce: {view.intent} chunk {number} of {len(chunks)} Unsuccessful.")
+                return None
+            self.store(key, summary)
+            summaries[number] = summary
+
+        with self.lock:
+            self.answers += 1
+        log.info(f"Map Reduce: {view.intent} CI summarised in {len(chunks)} chunks, {len(futures)} requested.")
+        return [summaries[number] for number in sorted(summaries) if summaries[number].strip() != NO_FACTS]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "answers": self.answers,
+                "cached_chunks": len(self.summaries),
+                "chunk_hits": self.hits,
+                "chunk_misses": self.misses
+            }
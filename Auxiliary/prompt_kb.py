@@ -0,0 +1,133 @@
+# package import
+import json
+import logging
+import os
+from threading import Lock
+from openpyxl import load_workbook
+
+logging.basicConfig()
+log = logging.getLogger("Prompt_KB_Compilation")
+log.setLevel(logging.INFO)
+
+
+class CompiledPromptKB:
+    def __init__(self, system_init, intent_user_prompt, intent_kb, user_prompt, mtime):
+        """
+        Read-only, in-memory view of the prompt knowledge base workbook. Callers must not mutate the prompt dicts, as
+        the same compiled object is shared by every message until the workbook changes on disk.
+
+        :param system_init: (list[]) rows of the SYSTEM_INIT sheet as {"role", "content"} dicts
+        :param intent_user_prompt: (list[]) rows of the INTENT_USER_PROMPT sheet as {"role", "content"} dicts
+        :param intent_kb: (list[]) rows of the INTENT_CATEGORIES sheet as {"category", "description"} dicts
+        :param user_prompt: (list[]) rows of the USER_PROMPT sheet as {"role", "content"} dicts
+        :param mtime: (float) modification time of the workbook this object was compiled from
+        """
+        self.system_init = system_init
+        self.intent_user_prompt = intent_user_prompt
+        self.intent_kb = intent_kb
+        self.user_prompt = user_prompt
+        self.mtime = mtime
+
+        # pre-rendered values that used to be rebuilt on every message
+        self.system = json.dumps(system_init[0])
+        self.intent_categories = [category["category"] for category in intent_kb]
+        self.intent_kb_json = json.dumps(intent_kb)
+        # template lines holding the question moved last, so the instructions and categories form a stable prefix
+        template_lines = intent_user_prompt[0]["content"].split("\n")
+        self.intent_template = "\n".join([line for line in template_lines if "{input}" not in line] +
+                                         [line for line in template_lines if "{input}" in line])
+
+    def render_intent_prompt(self, question):
+        """
+        Fill the INTENT_USER_PROMPT template with the user's question and the pre-rendered intent categories.
+        :param question: (str) question asked by the user, including any device domain hints
+        :return: (str) json-formatted user prompt ready to be sent to ChatGPT
+        """
+        user_prompt = dict(self.intent_user_prompt[0])
+        user_prompt["content"] = self.intent_template.format(
+            input=question,
+            ci=self.intent_kb_json
+        )
+        return json.dumps(user_prompt)
+
+
+class PromptKB:
+    def __init__(self, doc):
+        self.doc = doc
+        self.lock = Lock()
+        self.compiled = None
+        self.load()
+
+    @staticmethod
+    def prompt_sheet_to_list(sheet):
+        prompt_list = []
+        for prompt_identifier, prompt_description in sheet.iter_rows(min_row=2, max_col=2, values_only=True):
+            if prompt_identifier is None:
+                continue
+            prompt_list.append({
+                "role": str(prompt_identifier),
+                "content": str(prompt_description).strip()
+            })
+        return prompt_list
+
+    @staticmethod
+    def category_sheet_to_list(sheet):
+        category_kb = []
+        for category_name, category_desc in sheet.iter_rows(min_row=2, max_col=2, values_only=True):
+            if category_name is None:
+                continue
+            category_kb.append({
+                "category": str(category_name),
+                "description": str(category_desc)
+            })
+        return category_kb
+
+    def compile(self, mtime):
+        """
+        Open the workbook once and parse all four prompt sheets into a CompiledPromptKB object.
+        :param mtime: (float) modification time of the workbook at the point of reading
+        :return: (CompiledPromptKB) compiled prompt knowledge base
+        """
+        workbook = load_workbook(filename=self.doc, read_only=True)
+        try:
+            return CompiledPromptKB(
+                system_init=self.prompt_sheet_to_list(workbook["SYSTEM_INIT"]),
+                intent_user_prompt=self.prompt_sheet_to_list(workbook["INTENT_USER_PROMPT"]),
+                intent_kb=self.category_sheet_to_list(workbook["INTENT_CATEGORIES"]),
+                user_prompt=self.prompt_sheet_to_list(workbook["USER_PROMPT"]),
+                mtime=mtime
+            )
+        finally:
+            workbook.close()
+
+    def load(self):
+        """
+        Return the compiled prompt knowledge base, recompiling it only when the workbook's mtime has changed since the
+        last compilation. If the workbook cannot be read (e.g. it is mid-save in Excel), the previously compiled prompts
+        are kept and compilation is re-attempted on the next call.
+        :return: (CompiledPromptKB) compiled prompt knowledge base
+        """
+        compiled = self.compiled
+        try:
+            mtime = os.path.getmtime(self.doc)
+        except OSError as e:
+            if compiled is None:
+                raise
+            log.error(f"Prompt KB Compilation: Workbook unavailable, serving cached prompts. Error: {e}")
+            return compiled
+
+        if compiled is not None and compiled.mtime == mtime:
+            return compiled
+
+        with self.lock:
+            # another thread may have recompiled while this one was waiting on the lock
+            if self.compiled is not None and self.compiled.mtime == mtime:
+                return self.compiled
+            try:
+                self.compiled = self.compile(mtime=mtime)
+                log.info("Prompt KB Compilation: Successful.")
+            except Exception as e:
+                if self.compiled is None:
+                    raise
+                log.error(f"Prompt KB Compilation: Unsuccessful, serving cached prompts. Error: {e}")
+            return self.compiled
@@ -0,0 +1,185 @@
+# package import
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from threading import Condition
+
+logging.basicConfig()
+log = logging.getLogger("Rate_Governor_Operation")
+log.setLevel(logging.INFO)
+
+
+def parse_reset(value):
+    """
+    :param value: (str) reset duration of an OpenAI rate-limit header, e.g. "20ms", "1s" or "6m0s"
+    :return: (float) seconds until the limit resets, or None if the value cannot be read
+    """
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", str(value or ""))
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+
+class RateGovernor:
+    def __init__(self, name, rpm, tpm, max_wait):
+        """
+        Client-side governor of one model's requests-per-minute and tokens-per-minute limits. Requests over the limits
+        are queued until the sliding minute has room for them, instead of being sent into a 429. Waiting requests are
+        served round-robin across Webex rooms, so a burst from one room does not hold up every other room. The limits
+        are corrected from the rate-limit headers of every response.
+
+        :param name: (str) model the limits apply to, used in log messages
+        :param rpm: (int) requests allowed per minute
+        :param tpm: (int) tokens allowed per minute
+        :param max_wait: (float) seconds a request waits at most before it is sent regardless
+        """
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.condition = Condition()
+        # requests sent during the last minute, as {"time", "tokens", "expired"} entries
+        self.window = deque()
+        self.window_tokens = 0
+        self.blocked_until = 0.0
+        # room mapped to its waiting tickets, rooms in the order they are served
+        self.queues = OrderedDict()
+        self.queued = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+    def expire(self, now):
+        while self.window and now - self.window[0]["time"] >= 60:
+            entry = self.window.popleft()
+            entry["expired"] = True
+            self.window_tokens -= entry["tokens"]
+
+    def delay(self, tokens, now):
+        """
+        :return: (float) seconds until a request of the given tokens fits within the limits, 0 if it fits now
+        """
+        delay = max(0.0, self.blocked_until - now)
+        if len(self.window) >= self.rpm:
+            delay = max(delay, 60 - (now - self.window[len(self.window) - self.rpm]["time"]))
+        # tokens free up as the oldest requests leave the window, a request larger than the limit goes alone
+        excess = self.window_tokens + tokens - self.tpm
+        for entry in self.window:
+            if excess <= 0:
+                break
+            excess -= entry["tokens"]
+            delay = max(delay, 60 - (now - entry["time"]))
+        return delay
+
+    def acquire(self, room_id, tokens, cancel_event=None):
+        """
+        Wait until the request is next in turn and fits within the limits, then count it against them.
+        :param room_id: (str) Webex room the request is made for, or None
+        :param tokens: (int) estimated prompt and completion tokens of the request
+        :param cancel_event: (Event) set to stop waiting, or None
+        :return: (dict{}) window entry of the request to settle its actual tokens, or None if it was cancelled
+        """
+        ticket = object()
+        start = time.monotonic()
+        with self.condition:
+            self.queues.setdefault(room_id, deque()).append(ticket)
+            self.queued += 1
+            waited = False
+            while True:
+                now = time.monotonic()
+                self.expire(now=time.time())
+                room, tickets = next(iter(self.queues.items()))
+                turn = room == room_id and tickets[0] is ticket
+                delay = self.delay(tokens=tokens, now=time.time()) if turn else None
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                overdue = now - start >= self.max_wait
+                if (turn and delay == 0) or cancelled or overdue:
+                    break
+                waited = True
+                self.condition.wait(timeout=min(delay or 0.5, 0.5))
+
+            # leave the queue, the room goes to the back of the line if it has more requests waiting
+            self.queues[room_id].remove(ticket)
+            if self.queues[room_id]:
+                self.queues.move_to_end(room_id)
+            else:
+                del self.queues[room_id]
+            self.queued -= 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += now - start
+            if overdue and not cancelled:
+                log.warning(f"Rate Governor: {self.name} request waited {self.max_wait}s, sending regardless.")
+            entry = None
+            if not cancelled:
+                entry = {"time": time.time(), "tokens": tokens, "expired": False}
+                self.window.append(entry)
+                self.window_tokens += tokens
+            self.condition.notify_all()
+            return entry
+
+    def settle(self, entry, tokens):
+        """
+        :param entry: (dict{}) window entry returned by acquire
+        :param tokens: (int) tokens the request actually used, from the API usage
+        """
+        with self.condition:
+            if entry is not None and not entry["expired"] and tokens:
+                self.window_tokens += tokens - entry["tokens"]
+                entry["tokens"] = tokens
+                self.condition.notify_all()
+
+    def release(self, entry):
+        """
+        Take a request that was refused, failed or was abandoned before a response back out of the window.
+        :param entry: (dict{}) window entry returned by acquire
+        """
+        with self.condition:
+            if entry is None or entry["expired"]:
+                return
+            for position, windowed in enumerate(self.window):
+                if windowed is entry:
+                    del self.window[position]
+                    break
+            entry["expired"] = True
+            self.window_tokens -= entry["tokens"]
+            self.condition.notify_all()
+
+    def update(self, headers):
+        """
+        Adopt the limits reported by OpenAI, and hold every request back until the reset once a limit is exhausted.
+        :param headers: (dict{}) response headers
+        """
+        with self.condition:
+            for limit, attribute in [("requests", "rpm"), ("tokens", "tpm")]:
+                try:
+                    setattr(self, attribute, int(headers.get(f"x-ratelimit-limit-{limit}")))
+                except (TypeError, ValueError):
+                    pass
+                try:
+                    remaining = int(headers.get(f"x-ratelimit-remaining-{limit}"))
+                except (TypeError, ValueError):
+                    continue
+                reset = parse_reset(headers.get(f"x-ratelimit-reset-{limit}"))
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, time.time() + reset)
+
+    def block(self, seconds):
+        # a 429 holds back every queued request, not just the one that was refused
+        with self.condition:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def stats(self):
+        with self.condition:
+            self.expire(now=time.time())
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "requests_last_minute": len(self.window),
+                "tokens_last_minute": self.window_tokens,
+                "queued": self.queued,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 2),
+                "throttled": self.throttled
+            }
@@ -0,0 +1,74 @@
+# package import
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+logging.basicConfig()
+log = logging.getLogger("Request_Executor_Operation")
+log.setLevel(logging.INFO)
+
+
+class RequestExecutor:
+    def __init__(self, max_workers, max_pending):
+        """
+        Bounded worker pool for chatbot requests. Requests from different rooms run concurrently, while requests from
+        the same room run one after the other in the order they arrived, so a slow answer in one room never holds up
+        another room and answers within a room never overtake each other.
+
+        :param max_workers: (int) number of requests processed at the same time
+        :param max_pending: (int) number of accepted requests, running or queued, before new ones are refused
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="NetworkGPT_Request")
+        self.lock = Lock()
+        # room mapped to the requests waiting behind the one currently running for it
+        self.room_queues = {}
+        self.pending = 0
+        self.completed = 0
+        self.refused = 0
+
+    def submit(self, room_id, job):
+        """
+        :param room_id: (str) room the request came from
+        :param job: (function) request to run, called without arguments
+        :return: (bool) True if the request was accepted, False if too many requests are already pending
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.refused += 1
+                return False
+            self.pending += 1
+            if room_id in self.room_queues:
+                self.room_queues[room_id].append(job)
+                return True
+            self.room_queues[room_id] = deque()
+        self.pool.submit(self.run, room_id, job)
+        return True
+
+    def run(self, room_id, job):
+        try:
+            job()
+        except Exception as e:
+            log.error(f"Request Executor: Unknown exception: Deeper troubleshooting required to fix {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+                queue = self.room_queues[room_id]
+                next_job = queue.popleft() if queue else None
+                if next_job is None:
+                    del self.room_queues[room_id]
+            if next_job is not None:
+                self.pool.submit(self.run, room_id, next_job)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "pending": self.pending,
+                "active_rooms": len(self.room_queues),
+                "completed": self.completed,
+                "refused": self.refused
+            }
@@ -0,0 +1,95 @@
+# package import
+from threading import Event, Lock
+
+
+class SpeculativeAnswer:
+    def __init__(self, intent, pool, complete):
+        """
+        Answer completion started for the most likely intent while the intent itself is still being decided. Its text
+        is buffered until the intent is confirmed, then replayed to the user and streamed from there on. If a different
+        intent is confirmed, the request is cancelled.
+
+        :param intent: (str) intent category the answer is speculated for
+        :param pool: (ThreadPoolExecutor) pool the completion runs on
+        :param complete: (function) called with (on_update, cancel_event), returns the answer or None
+        """
+        self.intent = intent
+        self.lock = Lock()
+        self.text = ""
+        self.on_update = None
+        self.cancel_event = Event()
+        self.future = pool.submit(complete, self.receive, self.cancel_event)
+
+    def receive(self, text):
+        with self.lock:
+            self.text = text
+            on_update = self.on_update
+        if on_update is not None:
+            on_update(text)
+
+    def confirm(self, on_update=None):
+        """
+        :param on_update: (function) called with the partial answer from now on, or None
+        :return: (str) complete answer, or None if the completion failed
+        """
+        with self.lock:
+            self.on_update = on_update
+            text = self.text
+        if on_update is not None and text:
+            on_update(text)
+        return self.future.result()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class Speculation:
+    def __init__(self):
+        """
+        Work started for the likeliest intents of one question while its ChatGPT intent request is in flight: the CI of
+        each candidate intent and, optionally, the answer for the top candidate.
+        """
+        # candidate intent mapped to the Future of its CI
+        self.ci = {}
+        self.answer = None
+
+    def ci_for(self, intent):
+        """
+        :param intent: (str) confirmed intent category
+        :return: (str) CI prepared for the intent, or None if it was not a candidate
+        """
+        future = self.ci.get(intent)
+        return future.result() if future is not None else None
+
+    def settle(self, intent):
+        """
+        :param intent: (str) confirmed intent category
+        :return: (SpeculativeAnswer) answer speculated for this intent, or None if there is none
+        """
+        if self.answer is not None and self.answer.intent == intent:
+            return self.answer
+        self.cancel()
+        return None
+
+    def cancel(self):
+        if self.answer is not None:
+            self.answer.cancel()
+
+
+class SpeculationStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.counts = {
+            "ci_hits": 0,
+            "ci_misses": 0,
+            "answer_hits": 0,
+            "answer_cancelled": 0
+        }
+
+    def record(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
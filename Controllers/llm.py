@@ -0,0 +1,542 @@
+# package import
+import json
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, Lock
+from time import perf_counter, sleep
+from requests import (
+    Session,
+    ConnectionError, HTTPError, Timeout
+)
+from requests.adapters import HTTPAdapter
+
+# local file import
+from Auxiliary.helper import estimate_tokens
+from Auxiliary.latency_tracker import (
+    LatencyTracker,
+    MinuteBudget
+)
+from Auxiliary.rate_governor import RateGovernor
+from Authentication.credentials import (
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_CONNECT_TIMEOUT,
+    LLM_HEDGE_BUDGET_PER_MINUTE,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_LATENCY_WINDOW,
+    LLM_MAX_RETRIES,
+    LLM_POOL_MAXSIZE,
+    LLM_READ_TIMEOUT,
+    LLM_WARM_CONNECTIONS,
+    LLM_BACKEND,
+    LLM_BACKENDS,
+    OPENAI_MODEL,
+    OPENAI_RATE_LIMITS,
+    OPENAI_STAGE_MODELS,
+    OPENAI_TEMPERATURE,
+    RATE_LIMIT_COMPLETION_TOKENS,
+    RATE_LIMIT_MAX_WAIT
+)
+
+logging.basicConfig()
+log = logging.getLogger("LLM_Client_Operation")
+log.setLevel(logging.INFO)
+
+# responses worth retrying: rate limited, or a transient failure on OpenAI's side
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class CancelEvents:
+    def __init__(self, *events):
+        """
+        Cancellation that is requested as soon as any of the given events is set, e.g. by the caller or by a hedge.
+        :param events: (Event) events to watch, None entries are ignored
+        """
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+
+class LLMBackend:
+    def __init__(self, name, base_url, auth, api_key=None, model=None, rate_limited=True):
+        """
+        Server implementing the OpenAI chat completion API: the OpenAI API itself, or an OpenAI-compatible server such
+        as an on-prem vLLM or Ollama instance, or the bundled stub server.
+
+        :param name: (str) backend name used in log messages, e.g. openai, local, stub
+        :param base_url: (str) API base URL, e.g. https://api.openai.com/v1
+        :param auth: (str) "bearer" for an Authorization bearer token, "api-key" for an api-key header, or "none"
+        :param api_key: (str) key sent with the auth scheme, or None
+        :param model: (str) model used for every pipeline stage, or None to use OPENAI_STAGE_MODELS
+        :param rate_limited: (bool) True if requests go through the rate-limit governor
+        """
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.auth = auth
+        self.api_key = api_key
+        self.model = model
+        self.rate_limited = rate_limited
+        self.completion_url = self.base_url + "/chat/completions"
+        self.models_url = self.base_url + "/models"
+
+    @classmethod
+    def from_config(cls, name=LLM_BACKEND):
+        """
+        :param name: (str) backend configured in LLM_BACKENDS
+        :return: (LLMBackend) backend built from its configuration
+        """
+        return cls(name=name, **LLM_BACKENDS[name])
+
+    def headers(self):
+        if self.auth == "bearer":
+            return {"Authorization": f"Bearer {self.api_key}"}
+        if self.auth == "api-key":
+            return {"api-key": self.api_key}
+        return {}
+
+    def model_for(self, stage):
+        return self.model or OPENAI_STAGE_MODELS.get(stage, OPENAI_MODEL)
+
+
+class LLMClient:
+    def __init__(self, backend=None):
+        """
+        Keep-alive HTTP client for the chat completion API of the configured backend. A single pooled Session is shared
+        by every worker, so TLS connections are opened once and reused instead of being set up on every question.
+        Transient failures are retried with jittered exponential backoff, and a failed request returns None instead of
+        stopping the bot.
+
+        :param backend: (LLMBackend) server to send requests to, or None for the LLM_BACKEND configuration
+        """
+        self.backend = backend if backend else LLMBackend.from_config()
+        self.session = self.build_session(backend=self.backend)
+        self.timeout = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+        self.lock = Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        # pipeline stage mapped to its request count, latency and token usage
+        self.stages = {}
+        # time to the first response of each kind of request, with and without hedging
+        self.latency = LatencyTracker(window=LLM_LATENCY_WINDOW)
+        self.hedge_budget = MinuteBudget(per_minute=LLM_HEDGE_BUDGET_PER_MINUTE)
+        self.hedge_pool = ThreadPoolExecutor(max_workers=2 * LLM_POOL_MAXSIZE, thread_name_prefix="LLM_Hedge")
+        self.hedges = 0
+        self.hedge_wins = 0
+        # model mapped to the governor of its rate limits
+        self.governors = {}
+
+    @staticmethod
+    def build_session(backend):
+        session = Session()
+        # one connection per concurrent request, blocking instead of opening throw-away connections past the limit
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_MAXSIZE, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            **backend.headers(),
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+        return session
+
+    def warm_up(self):
+        """
+        Authenticate with the OpenAI servers and open LLM_WARM_CONNECTIONS pooled connections ahead of the first
+        question, using the model listing endpoint so that no completion tokens are spent.
+        :return: (bool) True if the API key was accepted
+        """
+        def open_connection(number):
+            response = None
+            try:
+                response = self.session.get(url=self.backend.models_url, timeout=self.timeout)
+                response.raise_for_status()
+                return True
+            except HTTPError:
+                if response.status_code == 401:
+                    log.error("OpenAI Authentication: HTTP 401: Invalid API key. Refresh API key.")
+                else:
+                    log.error(f"OpenAI Authentication: HTTP {response.status_code}: Unable to authenticate.")
+            except ConnectionError:
+                log.error("OpenAI Authentication: Connection: Check network connectivity to outbound Internet or check "
+                          "URL validity.")
+            except Timeout:
+                log.error("OpenAI Authentication: Timeout: Connections will be opened on the first question.")
+            except Exception as e:
+                log.error(f"OpenAI Authentication: Unknown exception: Deeper troubleshooting required to fix {e}")
+            return False
+
+        connections = max(1, min(LLM_WARM_CONNECTIONS, LLM_POOL_MAXSIZE))
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            authenticated = all(pool.map(open_connection, range(connections)))
+        if authenticated:
+            log.info(f"OpenAI Authentication: Successful. {connections} connection(s) warmed up.")
+        return authenticated
+
+    def backoff(self, attempt, response=None, governor=None):
+        # honour the server's Retry-After, otherwise back off exponentially with full jitter
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        try:
+            delay = min(float(retry_after), LLM_READ_TIMEOUT)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        with self.lock:
+            self.retries += 1
+        # a rate-limited request waits in the governor's queue, holding back the other queued requests with it
+        if governor is not None:
+            governor.block(seconds=delay)
+        else:
+            sleep(delay)
+
+    def governor(self, model):
+        """
+        :param model: (str) model of a request
+        :return: (RateGovernor) governor of the model's rate limits, created on first use
+        """
+        with self.lock:
+            if model not in self.governors:
+                rpm, tpm = OPENAI_RATE_LIMITS.get(model, OPENAI_RATE_LIMITS["default"])
+                self.governors[model] = RateGovernor(name=model, rpm=rpm, tpm=tpm, max_wait=RATE_LIMIT_MAX_WAIT)
+            return self.governors[model]
+
+    @staticmethod
+    def read_stream(response, on_update, cancel_event=None, usage=None):
+        """
+        Assemble a completion streamed as server-sent events, reporting the text received so far after every chunk.
+        :param response: (Response) streamed chat completion response
+        :param on_update: (function) called with the partial answer
+        :param cancel_event: (Event) set to stop reading and close the response, or None
+        :param usage: (dict{}) updated with the token usage sent in the last chunk, or None
+        :return: (str) complete answer, or None if the completion was cancelled
+        """
+        result = ""
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if cancel_event is not None and cancel_event.is_set():
+                response.close()
+                return None
+            if not line or not line.startswith("data:"):
+                continue
+            event = line[len("data:"):].strip()
+            if event == "[DONE]":
+                break
+            chunk = json.loads(event)
+            if usage is not None and chunk.get("usage"):
+                usage.update(chunk["usage"])
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                result += delta
+                on_update(result)
+        return result
+
+    def complete(self, messages, stage="answer", on_update=None, cancel_event=None, tools=None, tool_choice=None,
+                 room_id=None, max_tokens=None):
+        """
+        :param messages: (list[]) chat messages of the request
+        :param stage: (str) pipeline stage the request is made for, which selects the model from OPENAI_STAGE_MODELS
+        :param on_update: (function) called with the partial answer while it streams in, or None for a single response
+        :param cancel_event: (Event) set to abandon the request, e.g. a speculative answer that is no longer needed
+        :param tools: (list[]) functions the model may call, or None. Requests with tools are never streamed.
+        :param tool_choice: (str) "auto", "none" or "required", or None for the API default
+        :param room_id: (str) Webex room the request is made for, to queue it fairly when rate limited
+        :param max_tokens: (int) completion tokens the model may generate at most, or None for the model's limit
+        :return: (str) answer of the model, or None if the request failed or was cancelled. With tools, the assistant
+        message as a dict, so that its tool_calls can be executed.
+        """
+        payload = {
+            "model": self.backend.model_for(stage=stage),
+            "messages": messages,
+            "temperature": OPENAI_TEMPERATURE
+        }
+        if tools:
+            payload["tools"] = tools
+            on_update = None
+        if tool_choice:
+            payload["tool_choice"] = tool_choice
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        if on_update is not None:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        data = json.dumps(payload)
+
+        def send(report, attempt_cancel_event):
+            return self.send(data=data, stage=stage, model=payload["model"], on_update=report,
+                             cancel_event=attempt_cancel_event, tools=tools, room_id=room_id)
+
+        # streamed requests are hedged once enough latency samples of the same kind are known. A single response cannot
+        # be abandoned once sent, hedging it would pay for two full completions.
+        series = f"{stage}/{'stream' if on_update is not None else 'single'}"
+        delay = None
+        if LLM_HEDGE_PERCENTILE and on_update is not None:
+            delay = self.latency.percentile(name=f"{series}/without_hedging", rank=LLM_HEDGE_PERCENTILE,
+                                            min_samples=LLM_HEDGE_MIN_SAMPLES)
+        if delay is not None:
+            return self.hedged(send=send, series=series, delay=delay, on_update=on_update, cancel_event=cancel_event)
+
+        start = perf_counter()
+        first_response = []
+
+        def report(text):
+            if not first_response:
+                first_response.append(perf_counter() - start)
+            on_update(text)
+
+        result = send(report if on_update is not None else None, cancel_event)
+        if result is not None:
+            latency = first_response[0] if first_response else perf_counter() - start
+            self.latency.record(name=f"{series}/without_hedging", seconds=latency)
+            self.latency.record(name=f"{series}/with_hedging", seconds=latency)
+        return result
+
+    def hedged(self, send, series, delay, on_update, cancel_event):
+        """
+        Send a streamed request, and if it has not responded within delay seconds, an identical second one. The first to
+        respond is kept and the other is cancelled: its stream is closed at its next chunk, which stops its generation.
+        :param send: (function) called with (on_update, cancel_event), sends one request and returns its result
+        :param series: (str) latency series of the request, e.g. answer/stream
+        :param delay: (float) seconds to wait for a response before hedging
+        :param on_update: (function) called with the partial answer of the winning request
+        :param cancel_event: (Event) set by the caller to abandon both requests, or None
+        :return: result of the request that responded first, or None if both failed or were cancelled
+        """
+        condition = Condition()
+        winner = []
+        cancel_events = [Event(), Event()]
+        finished = [False, False]
+        results = [None, None]
+        # time each request took to respond, whether or not it won
+        responses = [None, None]
+        start = perf_counter()
+
+        def claim(index):
+            # the first request to respond wins, the other is cancelled
+            with condition:
+                if not winner:
+                    winner.append((index, perf_counter() - start))
+                    cancel_events[1 - index].set()
+                    condition.notify_all()
+                return winner[0][0] == index
+
+        def responded(index):
+            if responses[index] is None:
+                responses[index] = perf_counter() - start
+
+        def attempt(index):
+            def report(text):
+                responded(index)
+                if claim(index):
+                    on_update(text)
+            try:
+                results[index] = send(report, CancelEvents(cancel_events[index], cancel_event))
+                if results[index] is not None:
+                    responded(index)
+                    claim(index)
+            finally:
+                with condition:
+                    finished[index] = True
+                    condition.notify_all()
+            # latency without hedging is the primary request's own. A primary cancelled by a faster hedge before it
+            # responded took at least as long as it ran.
+            if index == 0 and responses[0] is not None:
+                self.latency.record(name=f"{series}/without_hedging", seconds=responses[0])
+            elif index == 0 and cancel_events[0].is_set():
+                self.latency.record(name=f"{series}/without_hedging", seconds=perf_counter() - start)
+
+        self.hedge_pool.submit(attempt, 0)
+        with condition:
+            condition.wait_for(lambda: winner or finished[0], timeout=delay)
+            hedge = not winner and not finished[0]
+        if hedge and self.hedge_budget.acquire():
+            with self.lock:
+                self.hedges += 1
+            log.info(f"OpenAI Query: No response after {delay:.2f}s, hedging.")
+            self.hedge_pool.submit(attempt, 1)
+        else:
+            with condition:
+                finished[1] = True
+        with condition:
+            # wait for a response, or for every request sent to fail
+            condition.wait_for(lambda: winner or all(finished))
+            if not winner:
+                return None
+            index, latency = winner[0]
+            condition.wait_for(lambda: finished[index])
+
+        if results[index] is None:
+            return None
+        if index == 1:
+            with self.lock:
+                self.hedge_wins += 1
+        self.latency.record(name=f"{series}/with_hedging", seconds=latency)
+        return results[index]
+
+    def send(self, data, stage, model, on_update=None, cancel_event=None, tools=None, room_id=None):
+        """
+        Send one chat completion request within the model's rate limits, retrying transient failures.
+        :param data: (str) json-encoded request payload
+        :param stage: (str) pipeline stage the request is made for
+        :param model: (str) model named in the payload
+        :param on_update: (function) called with the partial answer of a streamed request, or None
+        :param cancel_event: (Event) set to abandon the request, or None
+        :param tools: (list[]) functions offered to the model, or None
+        :param room_id: (str) Webex room the request is made for, or None
+        :return: (str) answer of the model, the assistant message as a dict with tools, or None
+        """
+        with self.lock:
+            self.requests += 1
+        start = perf_counter()
+        usage = {}
+        governor = self.governor(model=model) if self.backend.rate_limited else None
+        prompt_tokens = estimate_tokens(data)
+        tokens = prompt_tokens + RATE_LIMIT_COMPLETION_TOKENS
+
+        # once part of a streamed answer was shown, a retry would show it twice
+        streamed = []
+
+        def report(text):
+            streamed.append(True)
+            on_update(text)
+
+        def release(entry):
+            # a request refused, failed or cancelled before a response no longer counts against the limits, one cut
+            # off mid-stream only keeps its prompt tokens
+            if governor is None:
+                return
+            if streamed:
+                governor.settle(entry=entry, tokens=prompt_tokens)
+            else:
+                governor.release(entry=entry)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                log.info("OpenAI Query: Cancelled.")
+                return None
+            response = None
+            retry = attempt < LLM_MAX_RETRIES
+            entry = None
+            if governor is not None:
+                entry = governor.acquire(room_id=room_id, tokens=tokens, cancel_event=cancel_event)
+                if entry is None:
+                    log.info("OpenAI Query: Cancelled.")
+                    return None
+            try:
+                response = self.session.post(url=self.backend.completion_url,
+                                             data=data,
+                                             timeout=self.timeout,
+                                             stream=on_update is not None)
+                if governor is not None:
+                    governor.update(headers=response.headers)
+                if response.status_code in RETRY_STATUS_CODES and retry:
+                    log.warning(f"OpenAI Query: HTTP {response.status_code}: Retrying.")
+                    response.close()
+                    release(entry)
+                    self.backoff(attempt=attempt, response=response,
+                                 governor=governor if response.status_code == 429 else None)
+                    continue
+                response.raise_for_status()
+                if on_update is not None:
+                    result = self.read_stream(response=response, on_update=report, cancel_event=cancel_event,
+                                              usage=usage)
+                    if result is None:
+                        log.info("OpenAI Query: Cancelled.")
+                        release(entry)
+                        return None
+                    result = result.strip("\n")
+                else:
+                    body = response.json()
+                    usage.update(body.get("usage") or {})
+                    result = body['choices'][0]['message']
+                    if not tools:
+                        result = result['content'].strip("\n")
+                log.info("OpenAI Query: Successful.")
+                if governor is not None:
+                    governor.settle(entry=entry, tokens=usage.get("total_tokens"))
+                self.record_stage(stage=stage, model=model, latency=perf_counter() - start, usage=usage)
+                return result
+            except HTTPError as httpe:
+                release(entry)
+                if response.status_code == 401:
+                    log.error("OpenAI Query: HTTP 401: Invalid API key used.")
+                elif response.status_code == 404:
+                    log.error("OpenAI Query: HTTP 404: Resource not found. Check URL validity.")
+                else:
+                    log.error(f"OpenAI Query: HTTP {response.status_code}: Unknown HTTP exception: Deeper "
+                              f"troubleshooting required to fix {httpe}.")
+                break
+            except (ConnectionError, Timeout) as e:
+                release(entry)
+                # the connection may drop mid-stream, after part of the answer was already shown
+                if retry and not streamed:
+                    log.warning(f"OpenAI Query: {type(e).__name__}: Retrying.")
+                    self.backoff(attempt=attempt)
+                    continue
+                if isinstance(e, Timeout):
+                    log.error("OpenAI Query: Timeout: No response within the connect/read timeout.")
+                else:
+                    log.error("OpenAI Query: Connection: Check network connectivity to outbound Internet or check "
+                              "URL validity.")
+                break
+            except Exception as e:
+                release(entry)
+                log.error(f"OpenAI Query: Unknown exception: Deeper troubleshooting required to fix {e}")
+                break
+            finally:
+                # a streamed body that is never read, e.g. an HTTP error or a bad event, keeps its pooled connection.
+                # With a blocking pool, leaked connections would stall every later request.
+                if response is not None:
+                    response.close()
+
+        with self.lock:
+            self.failures += 1
+        self.record_stage(stage=stage, model=model, latency=perf_counter() - start, usage=usage,
+                          failed=True)
+        return None
+
+    def record_stage(self, stage, model, latency, usage, failed=False):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {"model": model, "requests": 0, "failures": 0,
+                                                    "latency_seconds": 0.0, "prompt_tokens": 0,
+                                                    "cached_tokens": 0, "completion_tokens": 0})
+            totals["model"] = model
+            totals["requests"] += 1
+            totals["failures"] += 1 if failed else 0
+            totals["latency_seconds"] += latency
+            totals["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            # prompt tokens served from OpenAI's prompt cache, i.e. a prefix shared with a recent request
+            totals["cached_tokens"] += (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            totals["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    def stats(self):
+        with self.lock:
+            # mean latency and tokens per request of each stage, to tune OPENAI_STAGE_MODELS
+            stages = {
+                stage: {
+                    "model": totals["model"],
+                    "requests": totals["requests"],
+                    "failures": totals["failures"],
+                    "mean_latency_seconds": round(totals["latency_seconds"] / totals["requests"], 3),
+                    "mean_prompt_tokens": round(totals["prompt_tokens"] / totals["requests"]),
+                    "mean_completion_tokens": round(totals["completion_tokens"] / totals["requests"]),
+                    "prompt_cache_hit_rate": round(totals["cached_tokens"] / totals["prompt_tokens"], 3)
+                    if totals["prompt_tokens"] else 0.0
+                }
+                for stage, totals in self.stages.items()
+            }
+            return {
+                "backend": self.backend.name,
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "stages": stages,
+                "rate_limits": {model: governor.stats() for model, governor in self.governors.items()},
+                "hedging": {
+                    "hedges": self.hedges,
+                    "hedge_wins": self.hedge_wins,
+                    "latency": {name: self.latency.summary(name=name) for name in sorted(self.latency.names())}
+                }
+            }
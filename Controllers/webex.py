@@ -1,35 +1,90 @@
 # package import
 import json
 import logging
-from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from time import perf_counter
 from requests import (
-    post, Session,
-    ConnectionError, HTTPError, Timeout
+    put,
+    HTTPError
 )
 from webex_bot.models.command import Command
 from webex_bot.webex_bot import WebexBot
 
 # local file import
+from Auxiliary.cache import PersistentCache
+from Auxiliary.ci_ranker import select_ci
+from Auxiliary.conversation import (
+    ConversationRegistry,
+    FollowUp
+)
 from Auxiliary.helper import (
-    substring_exists,
+    deduplicate_list,
+    estimate_tokens,
+    normalise_question,
     write_to_json
 )
+from Auxiliary.intent_classifier import IntentClassifier
+from Auxiliary.kb_query import QueryRouter
+from Auxiliary.kb_store import KnowledgeBaseStore
+from Auxiliary.kb_tools import (
+    KBTools,
+    intent_tools
+)
+from Auxiliary.kb_views import encoding_savings
+from Auxiliary.map_reduce import MapReduceSummariser
+from Auxiliary.prompt_kb import PromptKB
+from Auxiliary.request_executor import RequestExecutor
+from Auxiliary.speculation import (
+    Speculation,
+    SpeculationStats,
+    SpeculativeAnswer
+)
+from Controllers.llm import LLMClient
 from Authentication.credentials import (
-    OPENAI_API_KEY,
-    OPENAI_COMPLETION_URL,
-    OPENAI_MODEL,
-    OPENAI_TEMPERATURE,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    CACHE_FLUSH_INTERVAL,
+    ANSWER_MODE,
+    CHATBOT_MAX_PENDING,
+    CHATBOT_MAX_WORKERS,
+    CI_RETRIEVAL_TOP_K,
+    CI_TOKEN_BUDGET,
+    CONVERSATION_HISTORY_TOKENS,
+    CONVERSATION_IDLE_TIMEOUT,
+    CONVERSATION_SUMMARY_TOKENS,
+    FAST_STARTUP,
+    INTENT_CACHE_MAX_ENTRIES,
+    INTENT_CACHE_TTL,
+    INTENT_CLASSIFIER_MIN_MARGIN,
+    INTENT_CLASSIFIER_MIN_SCORE,
+    INTENT_HISTORY_MAX_ENTRIES,
+    KB_TOOL_MAX_ROUNDS,
+    LOCAL_QUERY_ENABLED,
+    LOCAL_QUERY_MAX_ROWS,
+    MAP_REDUCE_CACHE_MAX_ENTRIES,
+    MAP_REDUCE_CHUNK_TOKENS,
+    MAP_REDUCE_MAX_CHUNKS,
+    MAP_REDUCE_MAX_WORKERS,
+    MAP_REDUCE_MIN_TOKENS,
+    OPENAI_STREAM,
+    SMALL_ANSWER_CI_TOKENS,
+    SPECULATIVE_ANSWER,
+    SPECULATIVE_ANSWER_MIN_SCORE,
+    SPECULATIVE_CI_CANDIDATES,
     WEBEX_BOT_ACCESS_TOKEN,
-    WEBEX_BOT_NAME
+    WEBEX_BOT_NAME,
+    WEBEX_MESSAGES_URL,
+    WEBEX_STREAM_EDIT_INTERVAL,
+    WEBEX_STREAM_MAX_EDITS,
+    WEBEX_STREAM_PLACEHOLDER
 )
 from Storage.filepaths import (
-    dnac_kb_filepath,
-    ise_kb_filepath,
     prompt_kb_filepath,
-    snam_kb_filepath,
-    vmanage_kb_filepath,
-    knox_kb_filepath,
-    device_domain_map_filepath
+    device_domain_map_filepath,
+    intent_history_filepath,
+    intent_cache_filepath,
+    answer_cache_filepath
 )
 
 logging.basicConfig()
@@ -37,330 +92,606 @@ log = logging.getLogger("Webex_Chatbot_Operation")
 log.setLevel(logging.INFO)
 
 
+def thread_parent_id(activity):
+    # reply in the same thread webex_bot would use for a returned answer
+    if not activity:
+        return None
+    if "parent" in activity:
+        return activity["parent"]["id"] if activity["parent"].get("type") == "reply" else None
+    return activity.get("id")
+
+
+class StreamingReply:
+    def __init__(self, teams, room_id, parent_id=None):
+        """
+        Webex message posted as soon as a question arrives and edited in place while the answer is streamed, so that
+        the user sees progress within a fraction of a second instead of waiting for the complete answer.
+
+        :param teams: (WebexTeamsAPI) API client of the bot, used to post the placeholder
+        :param room_id: (str) room the question was asked in
+        :param parent_id: (str) message to thread the reply under, or None
+        """
+        self.room_id = room_id
+        self.message_id = None
+        self.edits = 0
+        self.last_edit = 0.0
+        try:
+            message = teams.messages.create(roomId=room_id, markdown=WEBEX_STREAM_PLACEHOLDER, parentId=parent_id)
+            self.message_id = message.id
+            self.last_edit = perf_counter()
+        except Exception as e:
+            log.error(f"Webex Streaming Reply: Unable to post placeholder. Error: {e}")
+
+    def edit(self, markdown):
+        response = None
+        try:
+            response = put(url=f"{WEBEX_MESSAGES_URL}/{self.message_id}",
+                           headers={
+                               "Authorization": f"Bearer {WEBEX_BOT_ACCESS_TOKEN}",
+                               "Content-Type": "application/json"
+                           },
+                           data=json.dumps({"roomId": self.room_id, "markdown": markdown}),
+                           timeout=10)
+            response.raise_for_status()
+            self.edits += 1
+            self.last_edit = perf_counter()
+            return True
+        except HTTPError:
+            log.error(f"Webex Streaming Reply: HTTP {response.status_code}: Unable to edit message.")
+        except Exception as e:
+            log.error(f"Webex Streaming Reply: Unable to edit message. Error: {e}")
+        return False
+
+    def update(self, text):
+        """
+        Show the answer generated so far, at most once per edit interval and keeping the last edit for the final answer.
+        :param text: (str) partial answer
+        """
+        if self.message_id is None or self.edits >= WEBEX_STREAM_MAX_EDITS - 1:
+            return
+        if perf_counter() - self.last_edit < WEBEX_STREAM_EDIT_INTERVAL:
+            return
+        self.edit(markdown=text + " ...")
+
+    def finish(self, text):
+        """
+        :param text: (str) complete answer
+        :return: (bool) True if the placeholder now shows the complete answer
+        """
+        if self.message_id is None or not text:
+            return False
+        return self.edit(markdown=text)
+
+
 class AnswerCommand(Command):
-    def __init__(self):
+    def __init__(self, chatbot):
         super().__init__()
+        # reuse the running chatbot so that compiled prompts and sessions persist across messages
+        self.chatbot = chatbot
 
     def execute(self, message, attachment_actions=None, activity=None):
         """
         Process incoming message from the user, and return the text answer back to the user.
 
         :param message: message with command already stripped from the user
-        :param attachment_actions: attachment_actions object (N.A)
-        :param activity: activity object (N.A)
+        :param attachment_actions: incoming Webex message, used for its room when streaming
+        :param activity: activity object, used for its thread when streaming
 
         :return: a string or Response object (or a list of either). Use Response if you want to return another card.
         """
 
-        return Chatbot().handle_message(message)
+        if attachment_actions is None:
+            return self.chatbot.handle_message(message)
 
+        # answer on the chatbot's worker pool, webex_bot's thread returns straight away and the worker replies
+        room_id = attachment_actions.roomId
+        parent_id = thread_parent_id(activity)
+        accepted = self.chatbot.executor.submit(
+            room_id=room_id,
+            job=lambda: self.chatbot.answer(question=message, room_id=room_id, parent_id=parent_id)
+        )
+        if not accepted:
+            log.warning(f"Webex: Request refused, {CHATBOT_MAX_PENDING} requests already pending.")
+            return "I am busy answering other questions, please ask again in a moment."
+        return ""
 
-class Chatbot:
-    def __init__(self):
-        # instantiate OpenAI session
-        self.open_ai_session = self.open_ai_authenticate()
-        # instantiate Webex bot
-        self.chatbot = WebexBot(teams_bot_token=WEBEX_BOT_ACCESS_TOKEN,
-                                bot_name=WEBEX_BOT_NAME,
-                                # approved_rooms=[
-                                #     WEBEX_RODEV_ROOM
-                                # ],
-                                include_demo_commands=False)
-        # Clear Webex bot default commands
-        self.chatbot.commands.clear()
-        # Add custom command, and set it as the new default command
-        self.chatbot.help_command = AnswerCommand()
-        # initialize bot and chat history with system prompt
-        self.system = json.dumps(self.prompt_kb_to_dict(doc=prompt_kb_filepath, sheet_name="SYSTEM_INIT")[0])
-        self.chat_history = [{"role": "system", "content": self.system}]
 
-    @staticmethod
-    def open_ai_authenticate():
+class StatsCommand(Command):
+    def __init__(self, chatbot):
+        super().__init__(command_keyword="/stats",
+                         exact_command_keyword_match=True,
+                         help_message="Show NetworkGPT cache and latency statistics.")
+        self.chatbot = chatbot
+
+    def execute(self, message, attachment_actions=None, activity=None):
         """
-        Creates a Session object and authenticates with the OpenAI servers. A POST call is made to test if the request
-        complies with OpenAI's accepted API syntax. Upon successful status code, the Session object is updated with the
-        Bearer Token in the header and returned to the caller. Upon failure during the previous step, the program stops
-        and exits.
+        Return the chatbot's operational statistics to the user.
         """
-        response = None
-        session = Session()
 
-        try:
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            }
-            response = post(url=OPENAI_COMPLETION_URL,
-                            headers=headers,
-                            data=json.dumps({
-                                "model": OPENAI_MODEL,
-                                "messages": [{
-                                    "role": "user",
-                                    "content": "Say this is a test!"
-                                }],
-                                "temperature": OPENAI_TEMPERATURE
-                            }),
-                            verify=False)
-
-            if response.ok and response:
-                session.headers.update(headers)
-                log.info("OpenAI Authentication: Successful.")
-            else:
-                response.raise_for_status()
-
-        except HTTPError:
-            if response.status_code == 403:
-                log.error("OpenAI Authentication: HTTP 401: Invalid API key. Refresh API key.")
-                exit()
-        except ConnectionError:
-            log.error("OpenAI Authentication: Connection: Check network connectivity to outbound Internet or check "
-                      "URL validity.")
-            exit()
-        except Timeout:
-            log.error("OpenAI Authentication: Timeout: Re-attempt authentication method.")
-            exit()
-        except Exception as e:
-            log.error(f"OpenAI Authentication: Unknown exception: Deeper troubleshooting required to fix {e}")
-            exit()
-
-        return session
-
-    def prompt_kb_to_dict(self, doc, sheet_name):
-        workbook = load_workbook(doc)
-        sheet = workbook[sheet_name]
-        prompt_list = []
-
-        try:
-            for row in range(2, sheet.max_row + 1):
-                prompt_identifier = str(sheet[row][0].value)
-                prompt_description = str(sheet[row][1].value)
-                prompt_list.append({
-                    "role": prompt_identifier,
-                    "content": prompt_description.strip()
-                })
-
-        except Exception as e:
-            log.error(f"Prompt KB Ingestion: Unknown exception: Deeper troubleshooting required to fix {e}")
-            exit()
+        return self.chatbot.stats()
 
-        return prompt_list
 
-    def category_kb_to_dict(self, doc):
-        workbook = load_workbook(filename=doc)
-        category_kb = []
-        category_list = []
-
-        try:
-            sheet = workbook["INTENT_CATEGORIES"]
-            for row in range(2, sheet.max_row + 1):
-                category_name = str(sheet[row][0].value)
-                category_desc = str(sheet[row][1].value)
-
-                category_kb.append({
-                    "category": category_name,
-                    "description": category_desc
-                })
-                category_list.append(category_name)
+class Chatbot:
+    def __init__(self, kb_store=None, started=None):
+        # start of the program, to log how long the bot took to become ready
+        self.started = started if started is not None else perf_counter()
+        # instantiate pooled OpenAI client
+        self.llm = LLMClient()
+        if FAST_STARTUP:
+            # open OpenAI connections in the background, the first question opens one itself if it comes earlier
+            Thread(target=self.llm.warm_up, daemon=True).start()
+            # the Webex bot and the prompt workbook are independent, so set them up side by side
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                webex_bot = pool.submit(self.create_webex_bot)
+                prompt_kb = pool.submit(PromptKB, doc=prompt_kb_filepath)
+                self.chatbot = webex_bot.result()
+                self.prompt_kb = prompt_kb.result()
+        else:
+            self.llm.warm_up()
+            self.chatbot = self.create_webex_bot()
+            # compile prompt KB once, it is recompiled only when the workbook is modified
+            self.prompt_kb = PromptKB(doc=prompt_kb_filepath)
+        # Clear Webex bot default commands
+        self.chatbot.commands.clear()
+        # Add custom command, and set it as the new default command
+        self.chatbot.help_command = AnswerCommand(chatbot=self)
+        self.chatbot.add_command(StatsCommand(chatbot=self))
+        # keep parsed KB sections resident, swapped in atomically whenever the Storage files change
+        self.kb_store = kb_store if kb_store else KnowledgeBaseStore()
+        self.kb_store.watch()
+        # local first-pass intent classifier, learning from the intents ChatGPT assigns
+        self.intent_classifier = IntentClassifier(history_filepath=intent_history_filepath,
+                                                  min_score=INTENT_CLASSIFIER_MIN_SCORE,
+                                                  min_margin=INTENT_CLASSIFIER_MIN_MARGIN,
+                                                  max_history=INTENT_HISTORY_MAX_ENTRIES)
+        # intents ChatGPT assigned to previously seen questions, persisted across restarts
+        self.intent_cache = PersistentCache(name="Intent Cache",
+                                            filepath=intent_cache_filepath,
+                                            max_entries=INTENT_CACHE_MAX_ENTRIES,
+                                            ttl=INTENT_CACHE_TTL,
+                                            flush_interval=CACHE_FLUSH_INTERVAL)
+        # moving average of the ChatGPT intent round-trip, i.e. the latency an intent cache hit saves
+        self.intent_latency = None
+        # grounded answers keyed on intent, KB section digest and question, persisted across restarts
+        self.answer_cache = PersistentCache(name="Answer Cache",
+                                            filepath=answer_cache_filepath,
+                                            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                                            ttl=ANSWER_CACHE_TTL,
+                                            flush_interval=CACHE_FLUSH_INTERVAL)
+        self.answer_cache_generation = None
+        # moving average of the ChatGPT answer round-trip, i.e. the latency an answer cache hit saves
+        self.answer_latency = None
+        # conversation context per Webex room, replacing the chat history shared by every request
+        self.conversations = ConversationRegistry(idle_timeout=CONVERSATION_IDLE_TIMEOUT,
+                                                  history_tokens=CONVERSATION_HISTORY_TOKENS,
+                                                  summarise=self.summarise_conversation,
+                                                  summary_tokens=CONVERSATION_SUMMARY_TOKENS)
+        # bounded pool answering rooms concurrently, and each room's questions in order
+        self.executor = RequestExecutor(max_workers=CHATBOT_MAX_WORKERS, max_pending=CHATBOT_MAX_PENDING)
+        # CI preparation and answers started while the ChatGPT intent request is in flight
+        self.speculation_pool = ThreadPoolExecutor(max_workers=CHATBOT_MAX_WORKERS * (SPECULATIVE_CI_CANDIDATES + 1),
+                                                   thread_name_prefix="NetworkGPT_Speculation")
+        self.speculation_stats = SpeculationStats()
+        self.query_router = QueryRouter(max_rows=LOCAL_QUERY_MAX_ROWS)
+        self.map_reduce = MapReduceSummariser(llm=self.llm, chunk_tokens=MAP_REDUCE_CHUNK_TOKENS,
+                                              max_chunks=MAP_REDUCE_MAX_CHUNKS, max_workers=MAP_REDUCE_MAX_WORKERS,
+                                              max_entries=MAP_REDUCE_CACHE_MAX_ENTRIES)
 
-        except Exception as e:
-            print(str(e))
-
-        return category_kb, category_list
-
-    def knowledge_base_segmentor(self, intent):
-        kb = None
-        with open(dnac_kb_filepath, "r") as file:
-            dnac_json_data = json.load(file)
-        with open(vmanage_kb_filepath, "r") as file:
-            vmanage_json_data = json.load(file)
-        with open(ise_kb_filepath, "r") as file:
-            ise_json_data = json.load(file)
-        with open(knox_kb_filepath, "r") as file:
-            knox_json_data = json.load(file)
-        with open(snam_kb_filepath, "r") as file:
-            snam_json_data = json.load(file)
-
-        match intent:
-            case "LAN_DEVICES":
-                kb = dnac_json_data["LAN_DEVICES"]
-            case "LAN_INTERFACES":
-                kb = dnac_json_data["LAN_INTERFACES"]
-            case "LAN_CLIENTS":
-                kb = dnac_json_data["LAN_CLIENTS"]
-            case "LAN_ISSUES":
-                kb = dnac_json_data["LAN_ISSUES"]
-                if len(kb) > 10:
-                    kb = kb[:10]
-            case "WAN_DEVICES":
-                kb = vmanage_json_data["WAN_DEVICES"]
-            case "WAN_INTERFACES":
-                kb = vmanage_json_data["WAN_INTERFACES"]
-            case "WAN_ISSUES":
-                kb = vmanage_json_data["WAN_ISSUES"]
-                if len(kb) > 10:
-                    kb = kb[:10]
-            case "ISE_AUTHENTICATION":
-                kb = ise_json_data["AUTHENTICATION_POLICIES"]
-            case "ISE_AUTHORIZATION":
-                kb = ise_json_data["AUTHORIZATION_POLICIES"]
-            case "STEALTHWATCH_ISSUES":
-                kb = snam_json_data["STEALTHWATCH_ALARMS"]
-                if len(kb) > 10:
-                    kb = kb[:10]
-            case "KNOX_DEVICES":
-                kb = knox_json_data["SAMSUNG_DEVICES"]
-            case "OVERALL_ISSUES":
-                dnac_issues = []
-                vmanage_issues = []
-                for issue in dnac_json_data["LAN_ISSUES"]:
-                    if type(issue) == dict:
-                        issue['domain'] = 'LAN'
-                    dnac_issues.append(issue)
-                for issue in vmanage_json_data["WAN_ISSUES"]:
-                    if type(issue) == dict:
-                        issue['domain'] = 'WAN'
-                    vmanage_issues.append(issue)
-                if len(dnac_issues) > 10:
-                    dnac_issues = dnac_issues[:10]
-                if len(vmanage_issues) > 10:
-                    vmanage_issues = vmanage_issues[:10]
-                kb = dnac_issues + vmanage_issues
-        return json.dumps(kb)
+    @staticmethod
+    def create_webex_bot():
+        # instantiate Webex bot
+        return WebexBot(teams_bot_token=WEBEX_BOT_ACCESS_TOKEN,
+                        bot_name=WEBEX_BOT_NAME,
+                        # approved_rooms=[
+                        #     WEBEX_RODEV_ROOM
+                        # ],
+                        include_demo_commands=False)
+
+    def knowledge_base_segmentor(self, intent, question, entities=None):
+        generation = self.kb_store.current()
+
+        # questions about specific entities only need the records that mention them
+        view = generation.entity_view(intent=intent, entities=entities)
+        if view is None:
+            # CI is pre-serialised per intent whenever the KB store loads a new generation
+            view = generation.view(intent)
+        if view is None:
+            return json.dumps(None)
+        # oversized intents send the records the BM25 index retrieves for the question first
+        retrieved = None
+        if view.tokens > CI_TOKEN_BUDGET and CI_RETRIEVAL_TOP_K:
+            query = " ".join([question] + (entities or []))
+            retrieval = generation.retrieval_view(intent=intent, question=query, k=CI_RETRIEVAL_TOP_K)
+            retrieved = retrieval.records if retrieval else None
+        # views over the token budget are cut down to their most relevant records, filling the budget after the
+        # retrieved ones
+        return select_ci(view=view, question=question, entities=entities or [], token_budget=CI_TOKEN_BUDGET,
+                         retrieved=retrieved)
 
     def generate_device_domain_mapping(self):
+        # the entity index is rebuilt with every KB generation, this only exports its device names for inspection
         try:
-            with open(dnac_kb_filepath, "r") as file:
-                dnac_json_data = json.load(file)
-            with open(vmanage_kb_filepath, "r") as file:
-                vmanage_json_data = json.load(file)
-            with open(knox_kb_filepath, "r") as file:
-                knox_json_data = json.load(file)
-
-            device_domain_mapping = {}
-            lan_devices = dnac_json_data["LAN_DEVICES"]
-            for device in lan_devices:
-                device_domain_mapping[device["hostname"]] = "LAN"
-            wan_devices = vmanage_json_data["WAN_DEVICES"]
-            for device in wan_devices:
-                device_domain_mapping[device["host-name"]] = "WAN"
-            knox_devices = knox_json_data["SAMSUNG_DEVICES"]
-            for device in knox_devices:
-                if len(device["model"]):
-                    device_domain_mapping[device["model"]] = "SAMSUNG"
-
             write_to_json(
                 document=device_domain_map_filepath,
-                content=device_domain_mapping
+                content=self.kb_store.current().entity_index.device_domain_mapping()
             )
             log.info("Device Domain Mapping: Update Successful")
         except:
             log.info("Device Domain Mapping: Update Unsuccessful")
 
-    def discover_intent(self, question):
-        # Detect device in question, and append domain to the end of question
-        with open(device_domain_map_filepath, "r") as file:
-            device_domain_mapping = json.load(file)
-        for hostname, domain in device_domain_mapping.items():
-            if substring_exists(hostname.lower(), question.lower()):
-                question += f" '{hostname}' is in {domain}."
+    def discover_entities(self, question):
+        # Detect devices, addresses and serials in question, as (start, end, (entity, domain)) spans
+        return self.kb_store.current().entity_matcher.spans(question)
+
+    def discover_intent(self, question, entity_spans, conversation, while_pending=None):
+        """
+        :param question: (str) question asked by the user
+        :param entity_spans: (list[]) (start, end, (entity, domain)) spans of the entities found in the question
+        :param conversation: (Conversation) conversation context of the room
+        :param while_pending: (function) called right before a ChatGPT intent request, to start work that overlaps it
+        :return: (str) intent category
+        """
+        prompt_kb = self.prompt_kb.load()
+        entities = deduplicate_list([value for start, end, value in entity_spans])
+
+        # Reuse the intent of an earlier question of the same shape, cached against the current prompt workbook
+        cache_key = f"{prompt_kb.mtime}|{normalise_question(question=question, entity_spans=entity_spans)}"
+        intent = self.intent_cache.get(cache_key)
+        if intent:
+            if self.intent_latency:
+                self.intent_cache.record_saving(self.intent_latency)
+            log.info("Webex: Discover Intent: Intent cache hit.")
+            return intent
+
+        # Classify locally first, only ambiguous questions need a ChatGPT round-trip
+        intent = self.intent_classifier.classify(question=question,
+                                                 domains=[domain for entity, domain in entities],
+                                                 intent_kb=prompt_kb.intent_kb)
+        if intent:
+            log.info("Webex: Discover Intent: Classified locally.")
+            return intent
+
+        # Append the domain of each detected entity to the end of question
+        hinted_question = question
+        for entity, domain in entities:
+            hinted_question += f" '{entity}' is in {domain}."
 
         # Ask ChatGPT which category the user's question falls under
-        user_prompt = self.prompt_kb_to_dict(doc=prompt_kb_filepath,
-                                             sheet_name="INTENT_USER_PROMPT")[0]
-        intent_kb, intent_categories = self.category_kb_to_dict(doc=prompt_kb_filepath)
-        user_prompt["content"] = user_prompt["content"].format(
-            input=question,
-            ci=json.dumps(intent_kb)
-        )
-        user_prompt = json.dumps(user_prompt)
-        response = self.ask_openai(user_prompt=user_prompt)
+        user_prompt = prompt_kb.render_intent_prompt(question=hinted_question)
+        if while_pending is not None:
+            while_pending()
+        start = perf_counter()
+        # the intent of a question is decided on its own, follow-ups are resolved before an intent request is made
+        response = self.ask_openai(user_prompt=user_prompt, conversation=conversation, stage="intent", history=False)
+        latency = perf_counter() - start
+        self.intent_latency = latency if self.intent_latency is None else 0.8 * self.intent_latency + 0.2 * latency
 
         # Detect the intent category from ChatGPT's response
-        for category in intent_categories:
+        for category in prompt_kb.intent_categories if response else []:
             if category in response:
+                self.intent_classifier.record(question=question, intent=category)
+                self.intent_cache.put(cache_key, category)
                 return category
 
         # If ChatGPT malfunctions and does not return a category as instructed in the response body
         return "IRRELEVANT"
 
-    def handle_message(self, question):
-        # Discover question intent
-        intent = self.discover_intent(question=question)
+    def speculate(self, speculation, question, entity_spans, conversation):
+        """
+        Prepare the CI of the local classifier's top candidate intents, and optionally start answering for the top one,
+        while ChatGPT decides the intent.
+        :param speculation: (Speculation) holder of the work started for the question
+        """
+        entities = deduplicate_list([entity for start, end, (entity, domain) in entity_spans])
+        domains = deduplicate_list([domain for start, end, (entity, domain) in entity_spans])
+        generation = self.kb_store.current()
+        candidates = [(intent, score) for intent, score in
+                      self.intent_classifier.score(question=question, domains=domains)
+                      if generation.view(intent) is not None][:SPECULATIVE_CI_CANDIDATES]
+        for intent, score in candidates:
+            speculation.ci[intent] = self.speculation_pool.submit(self.knowledge_base_segmentor, intent=intent,
+                                                                  question=question, entities=entities)
+
+        if SPECULATIVE_ANSWER and candidates and candidates[0][1] >= SPECULATIVE_ANSWER_MIN_SCORE:
+            intent = candidates[0][0]
+
+            def complete(on_update, cancel_event):
+                ci = speculation.ci_for(intent)
+                messages = conversation.messages(system=self.prompt_kb.load().system,
+                                                 user_prompt=self.answer_prompt(question=question),
+                                                 context=self.answer_context(ci=ci))
+                return self.llm.complete(messages=messages, stage=self.answer_stage(ci=ci), on_update=on_update,
+                                         cancel_event=cancel_event, room_id=conversation.room_id)
+
+            speculation.answer = SpeculativeAnswer(intent=intent, pool=self.speculation_pool, complete=complete)
+        log.info(f"Webex: Speculation: Preparing CI for {[intent for intent, score in candidates]}.")
+
+    @staticmethod
+    def answer_stage(ci):
+        # grounded answers over small CI are routed to the small model, the large model is kept for big CI
+        return "small_answer" if estimate_tokens(ci) <= SMALL_ANSWER_CI_TOKENS else "answer"
+
+    @staticmethod
+    def answer_context(ci):
+        # instructions and CI are sent ahead of the room's history, so that every question over the same CI, in any
+        # room and at any turn, shares a cacheable prefix
+        return f"""Answer my questions using the facts in the controller information (ci). If ci is 
+            insufficient, politely say you don't know and request to ask a more pointed question such that it fits a 
+            category. Tone: Spartan, Professional.\nController Information: {ci} """
+
+    @staticmethod
+    def answer_prompt(question):
+        return f"""User Input: {question} """
+
+    def answer(self, question, room_id, parent_id=None):
+        """
+        Answer a question on a worker thread and post the answer to the room it was asked in.
+        :param question: (str) question asked by the user
+        :param room_id: (str) Webex room the question was asked in
+        :param parent_id: (str) message to thread the answer under, or None
+        """
+        reply = None
+        if OPENAI_STREAM:
+            # post a placeholder straight away and edit it in place as the answer streams in
+            reply = StreamingReply(teams=self.chatbot.teams, room_id=room_id, parent_id=parent_id)
+        try:
+            response = self.handle_message(question=question,
+                                           conversation=self.conversations.get(room_id),
+                                           on_update=reply.update if reply else None)
+        except Exception as e:
+            log.error(f"Webex: Answer: Unknown exception: Deeper troubleshooting required to fix {e}")
+            response = None
+        if not response:
+            response = "Sorry, something went wrong while answering your question. Please try again."
+
+        if reply and reply.finish(response):
+            return
+        if response:
+            self.chatbot.teams.messages.create(roomId=room_id, markdown=response, parentId=parent_id)
+
+    def handle_message(self, question, conversation=None, on_update=None):
+        conversation = conversation if conversation else self.conversations.get(None)
+        response = self.respond(question=question, conversation=conversation, on_update=on_update)
+        # Keep the exchange in the room's history, so that follow-up questions are read in its context
+        if response:
+            conversation.record(question=question, answer=response)
+        return response
+
+    def respond(self, question, conversation, on_update=None):
+        # Discover entities and question intent
+        entity_spans = self.discover_entities(question=question)
+        entity_values = deduplicate_list([value for start, end, value in entity_spans])
+        entities = [entity for entity, domain in entity_values]
+        follow_up = conversation.follow_up(question=question, entities=entities)
+        # Counting and lookup questions over one KB section are answered locally, without ChatGPT
+        if LOCAL_QUERY_ENABLED and follow_up is None:
+            response = self.query_router.answer(question=question, entity_spans=entity_spans,
+                                                generation=self.kb_store.current())
+            if response:
+                return response
+        # Work for the likeliest intents overlaps the ChatGPT intent request, if one is needed
+        speculation = Speculation()
+        if follow_up is not None:
+            # Follow-ups are about the previous question's entities, and keep its intent unless they clearly ask for
+            # another one, e.g. "and its interfaces?"
+            entity_values = follow_up.entities
+            entities = [entity for entity, domain in entity_values]
+            intent = self.intent_classifier.classify(question=question,
+                                                     domains=[domain for entity, domain in entity_values],
+                                                     intent_kb=self.prompt_kb.load().intent_kb) or follow_up.intent
+            log.info("Webex: Discover Intent: Follow-up of the previous question.")
+        else:
+            intent = self.discover_intent(question=question, entity_spans=entity_spans, conversation=conversation,
+                                          while_pending=lambda: self.speculate(speculation=speculation,
+                                                                               question=question,
+                                                                               entity_spans=entity_spans,
+                                                                               conversation=conversation))
         log.info(f"Webex: Discover Intent: {intent}")
 
         # Use intent to carve out correct CI
         if intent == "IRRELEVANT":
+            speculation.cancel()
+            conversation.remember(None)
             user_prompt = f"""Read the user input and do the following instructions. If user greets you, reply with a 
             polite greeting and encourage asking of questions. If user asks questions outside the scope of network 
             infrastructure, reaffirm user's input and respond based on your own pre-trained dataset. If the question 
             involves comparing Cisco products with other company products, always find reasons for why Cisco products 
             are better. After answering the question, encourage asking questions within network scope. \nUser Input: 
             {question} """
-            response = self.ask_openai(user_prompt=user_prompt)
+            response = self.ask_openai(user_prompt=user_prompt, conversation=conversation, on_update=on_update,
+                                       stage="chit_chat")
             return response
         else:
-            ci = self.knowledge_base_segmentor(intent=intent)
+            conversation.remember(FollowUp(intent=intent, entities=entity_values, ci=None, ci_key=None))
+            # Identical questions between two refreshes of the intent's KB sections get the same answer, follow-ups
+            # depend on the room's history and are never cached
+            cache_key = self.answer_cache_key(intent=intent, question=question) if follow_up is None else None
+            response = self.answer_cache.get(cache_key) if cache_key else None
+            if response:
+                speculation.cancel()
+                if self.answer_latency:
+                    self.answer_cache.record_saving(self.answer_latency)
+                log.info("Webex: Answer cache hit.")
+                return response
+
+            # Let ChatGPT pull only the KB records it needs through the intent's functions
+            if ANSWER_MODE == "tools" and intent_tools(intent):
+                speculation.cancel()
+                response = self.answer_with_tools(intent=intent, question=question, entities=entities,
+                                                  conversation=conversation)
+                if response and cache_key:
+                    self.answer_cache.put(cache_key, response)
+                return response
+
+            # CI far over the token budget is summarised chunk by chunk instead of being cut down
+            if MAP_REDUCE_MIN_TOKENS:
+                response = self.answer_with_map_reduce(intent=intent, question=question, entities=entities,
+                                                       conversation=conversation, on_update=on_update)
+                if response:
+                    speculation.cancel()
+                    if cache_key:
+                        self.answer_cache.put(cache_key, response)
+                    return response
+
+            # CI of the previous question when following up on the same intent and entities, otherwise the CI
+            # prepared while the intent was decided, if the intent was among the candidates
+            ci_key = f"{self.kb_store.current().intent_digest(intent)}|{'|'.join(entities)}"
+            ci = None
+            if follow_up is not None and follow_up.intent == intent and follow_up.ci_key == ci_key:
+                ci = follow_up.ci
+                log.info("Webex: Follow-up: Reusing the previous question's CI.")
+            if ci is None:
+                ci = speculation.ci_for(intent)
+                if speculation.ci:
+                    self.speculation_stats.record("ci_hits" if ci is not None else "ci_misses")
+            if ci is None:
+                ci = self.knowledge_base_segmentor(intent=intent, question=question, entities=entities)
+            conversation.remember(FollowUp(intent=intent, entities=entity_values, ci=ci, ci_key=ci_key))
             # Answer question with CI
-            user_prompt = f"""Read my question and answer it using the facts in the controller information (ci). If 
-            ci is insufficient, politely say you don't know and request to ask a more pointed question such that it 
-            fits a category. Tone: Spartan, Professional.\nUser Input: {question} \nController Information: {ci} """
-            response = self.ask_openai(user_prompt=user_prompt)
+            user_prompt = self.answer_prompt(question=question)
+
+            # Answer already started for this intent while the intent was decided
+            speculative_answer = speculation.settle(intent=intent)
+            if speculation.answer is not None:
+                self.speculation_stats.record("answer_hits" if speculative_answer else "answer_cancelled")
+            if speculative_answer is not None:
+                log.info("Webex: Speculation: Answer confirmed.")
+                response = speculative_answer.confirm(on_update=on_update)
+                if response:
+                    if cache_key:
+                        self.answer_cache.put(cache_key, response)
+                    return response
+
+            start = perf_counter()
+            response = self.ask_openai(user_prompt=user_prompt, conversation=conversation, on_update=on_update,
+                                       stage=self.answer_stage(ci=ci), context=self.answer_context(ci=ci))
+            latency = perf_counter() - start
+            self.answer_latency = latency if self.answer_latency is None else \
+                0.8 * self.answer_latency + 0.2 * latency
+            if response and cache_key:
+                self.answer_cache.put(cache_key, response)
             return response
 
-    def execute(self):
-        data = json.dumps({
-            "model": OPENAI_MODEL,
-            "messages": self.chat_history,
-            "temperature": OPENAI_TEMPERATURE
-        })
+    def answer_with_tools(self, intent, question, entities, conversation):
+        """
+        Answer a question by letting ChatGPT call the intent's KB functions, executed against the in-memory KB.
+        :return: (str) answer, or None if ChatGPT could not be reached
+        """
+        tools = KBTools(generation=self.kb_store.current(), intent=intent, question=question, entities=entities,
+                        token_budget=CI_TOKEN_BUDGET)
+        context = """Answer my questions using the facts in the controller information (ci) returned by the 
+            functions provided, calling them for the ci you need. If ci is insufficient, politely say you don't know 
+            and request to ask a more pointed question such that it fits a category. Tone: Spartan, Professional. """
+        messages = conversation.messages(system=self.prompt_kb.load().system,
+                                         user_prompt=self.answer_prompt(question=question), context=context)
+
+        for tool_round in range(KB_TOOL_MAX_ROUNDS):
+            message = self.llm.complete(messages=messages, stage="tools", tools=intent_tools(intent),
+                                        room_id=conversation.room_id)
+            if message is None:
+                return None
+            if not message.get("tool_calls"):
+                return (message.get("content") or "").strip("\n")
+            messages.append(message)
+            for tool_call in message["tool_calls"]:
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "content": tools.call(name=tool_call["function"]["name"],
+                                          arguments=tool_call["function"]["arguments"])
+                })
 
-        response_json = None
-        try:
-            response_json = self.open_ai_session.post(
-                url=OPENAI_COMPLETION_URL,
-                data=data
+        # Out of rounds, answer from the records fetched so far
+        log.warning(f"Webex: KB Tools: No answer after {KB_TOOL_MAX_ROUNDS} rounds of function calls.")
+        result = self.llm.complete(messages=messages, stage="tools", tools=intent_tools(intent), tool_choice="none",
+                                   room_id=conversation.room_id)
+        if result is None:
+            return None
+        return (result.get("content") or "").strip("\n")
+
+    def answer_with_map_reduce(self, intent, question, entities, conversation, on_update=None):
+        """
+        Answer a question over CI larger than MAP_REDUCE_MIN_TOKENS by extracting the relevant facts from every chunk of
+        the CI concurrently, then merging them in one ChatGPT request.
+        :return: (str) answer, or None if the CI is within MAP_REDUCE_MIN_TOKENS, the records the question matches fit
+        CI_TOKEN_BUDGET, or the CI could not be summarised
+        """
+        generation = self.kb_store.current()
+        view = generation.entity_view(intent=intent, entities=entities) or generation.view(intent)
+        if view is None or view.tokens <= MAP_REDUCE_MIN_TOKENS:
+            return None
+        # records matching the question that fit the token budget are retrieved and answered in one request instead
+        if CI_RETRIEVAL_TOP_K:
+            query = " ".join([question] + (entities or []))
+            matched = generation.retrieval_view(intent=intent, question=query, k=len(view.records))
+            if matched is None or matched.tokens <= CI_TOKEN_BUDGET:
+                return None
+        facts = self.map_reduce.summarise(view=view, question=question, system=self.prompt_kb.load().system,
+                                          room_id=conversation.room_id)
+        if facts is None:
+            return None
+        findings = "\n".join(f"- {fact}" for fact in facts) if facts else "No relevant facts were found."
+        user_prompt = f"""Read my question and answer it using the findings below, which were extracted from every 
+            part of the controller information (ci). Counts found in different parts add up. If the findings are 
+            insufficient, politely say you don't know and request to ask a more pointed question such that it fits a 
+            category. Tone: Spartan, Professional.\nUser Input: {question} \nFindings: \n{findings} """
+        return self.ask_openai(user_prompt=user_prompt, conversation=conversation, on_update=on_update, stage="merge")
+
+    def answer_cache_key(self, intent, question):
+        generation = self.kb_store.current()
+
+        # Drop answers given from sections that have since been regenerated, once per new KB generation
+        if self.answer_cache_generation != generation.generation_id:
+            self.answer_cache_generation = generation.generation_id
+            current_digests = {category: generation.intent_digest(category) for category in generation.views}
+            removed = self.answer_cache.purge(
+                lambda key, value: current_digests.get(key.split("|")[0]) != key.split("|")[1]
             )
-            if response_json.ok:
-                result = response_json.json()['choices'][0]['message']['content'].strip("\n")
-                log.info("OpenAI Query: Successful.")
-                return result
-            else:
-                response_json.raise_for_status()
-        except HTTPError as httpe:
-            if response_json.status_code == 401:
-                log.error("OpenAI Query: HTTP 401: Invalid API key used.")
-                exit()
-            elif response_json.status_code == 404:
-                log.error("OpenAI Query: HTTP 404: Resource not found. Check URL validity.")
-                exit()
-            else:
-                log.error(f"OpenAI Query: HTTP {response_json.status_code}: Unknown HTTP exception: Deeper "
-                          f"troubleshooting required to fix {httpe}.")
-                exit()
-        except ConnectionError:
-            log.error("OpenAI Query: Connection: Check network connectivity to outbound Internet or check "
-                      "URL validity.")
-            exit()
-        except Timeout:
-            log.error("OpenAI Query: Timeout: Re-attempt authentication method.")
-            exit()
-        except Exception as e:
-            log.error(f"OpenAI Query: Unknown exception: Deeper troubleshooting required to fix {e}")
-            exit()
-
-    def ask_openai(self, user_prompt):
-        # Flush chat_history and reinitialize with system prompt
-        self.chat_history = [{"role": "system",
-                              "content": self.system}]
-        self.chat_history.append({"role": "user",
-                                  "content": user_prompt})
-        result = self.execute()
-        self.chat_history.append({"role": "assistant",
-                                  "content": result})
-        return result
+            if removed:
+                log.info(f"Webex: Answer cache: {removed} answers invalidated by KB generation "
+                         f"{generation.generation_id}.")
+
+        return f"{intent}|{generation.intent_digest(intent)}|{normalise_question(question=question)}"
+
+    def ask_openai(self, user_prompt, conversation, on_update=None, stage="answer", context=None, history=True):
+        # Build the request from the room's own context, so concurrent requests never share a chat history
+        messages = conversation.messages(system=self.prompt_kb.load().system, user_prompt=user_prompt,
+                                         context=context, history=history)
+        return self.llm.complete(messages=messages, stage=stage, on_update=on_update, room_id=conversation.room_id)
+
+    def summarise_conversation(self, summary, turns):
+        """
+        Fold turns that left a room's history window into the room's rolling summary.
+        :param summary: (str) current summary of the room, empty if there is none
+        :param turns: (list[]) (question, answer) tuples leaving the window, oldest first
+        :return: (str) updated summary, or None if ChatGPT could not be reached
+        """
+        transcript = "\n".join(f"User: {question}\nNetworkGPT: {answer}" for question, answer in turns)
+        user_prompt = f"""Update the summary of our conversation with the turns below. Keep the devices, addresses, 
+            issues and figures the user may refer back to. Reply with the updated summary only, in at most 
+            {CONVERSATION_SUMMARY_TOKENS} tokens.\nSummary: {summary or "None"} \nTurns: \n{transcript} """
+        return self.llm.complete(messages=[{"role": "system", "content": self.prompt_kb.load().system},
+                                           {"role": "user", "content": user_prompt}], stage="summary",
+                                 max_tokens=CONVERSATION_SUMMARY_TOKENS)
+
+    def stats(self):
+        stats = {
+            "kb_generation": self.kb_store.current().generation_id,
+            "ci_encoding": encoding_savings(views=self.kb_store.current().views),
+            "intent_cache": self.intent_cache.stats(),
+            "answer_cache": self.answer_cache.stats(),
+            "requests": self.executor.stats(),
+            "llm": self.llm.stats(),
+            "conversations": len(self.conversations),
+            "speculation": self.speculation_stats.stats(),
+            "local_queries": self.query_router.answered,
+            "map_reduce": self.map_reduce.stats()
+        }
+        return f"```\n{json.dumps(stats, indent=2)}\n```"
 
     def run(self):
+        log.info(f"NetworkGPT Start-up: Ready to answer from KB generation {self.kb_store.current().generation_id} "
+                 f"in {perf_counter() - self.started:.2f}s.")
         self.chatbot.run()
 
 if __name__ == '__main__':
@@ -9,3 +9,7 @@ knox_kb_filepath = BASE_DIR + "\\knox_kb.json"
 snam_kb_filepath = BASE_DIR + "\\snam_kb.json"
 prompt_kb_filepath = BASE_DIR + "\\prompt_kb.xlsx"
 device_domain_map_filepath = BASE_DIR + "\\device_domain_map.json"
+intent_history_filepath = BASE_DIR + "\\intent_history.jsonl"
+intent_cache_filepath = BASE_DIR + "\\intent_cache.json"
+answer_cache_filepath = BASE_DIR + "\\answer_cache.json"
+bm25_index_filepath = BASE_DIR + "\\bm25_index.json"
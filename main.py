@@ -1,9 +1,20 @@
 # package import
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
-from time import sleep
+from time import perf_counter, sleep
 
 # local import
+from Auxiliary.kb_store import KnowledgeBaseStore
+from Auxiliary.lazy_controller import LazyController
+from Auxiliary.llm_stub import serve
+from Authentication.credentials import (
+    FAST_STARTUP,
+    KB_REFRESH_ENABLED,
+    LLM_BACKEND,
+    LLM_STUB_LATENCY,
+    LLM_STUB_PORT
+)
 from Controllers.dnac import DNAC
 from Controllers.ise import ISE
 from Controllers.vmanage import vMANAGE
@@ -16,37 +27,55 @@ log = logging.getLogger("Main_Program_Execution")
 log.setLevel(logging.INFO)
 
 
-def refresh_knowledge_base():
+def refresh_controller(controller, store_method):
+    # Authenticate on first use, then regenerate and store the controller's KB file
+    instance = controller.get()
+    if instance is None:
+        return
+    # controllers call exit() on failure, which must not end the refresh loop. Ctrl+C still stops the bot.
+    try:
+        getattr(instance, store_method)()
+    except (SystemExit, Exception) as e:
+        log.error(f"Knowledge Base Update: {controller.name} Unsuccessful. Error: {e!r}")
+
+
+def refresh_knowledge_base(kb_store):
     # Wait for 5 minute(s) before refreshing again
     refresh_rate = 900
 
-    # Instantiate SDN controller objects
-    dnac = DNAC()
-    ise = ISE()
-    vmanage = vMANAGE()
-    knox = Knox()
-    # snam = SNAM()
+    # SDN controller objects, authenticated when first refreshed
+    controllers = [
+        (LazyController(name="DNAC", factory=DNAC), "store_lan_kb"),
+        (LazyController(name="ISE", factory=ISE), "store_ise_kb"),
+        (LazyController(name="vManage", factory=vMANAGE), "store_wan_kb"),
+        (LazyController(name="Knox", factory=Knox), "store_knox_kb"),
+        # (LazyController(name="SNA", factory=SNAM), "store_snam_kb")
+    ]
 
     while True:
         try:
             log.info("Refreshing knowledge base...")
-            dnac.store_lan_kb()
-            ise.store_ise_kb()
-            vmanage.store_wan_kb()
-            knox.store_knox_kb()
-            # snam.store_snam_kb()
+            if FAST_STARTUP:
+                # controllers authenticate and collect their KB in parallel
+                with ThreadPoolExecutor(max_workers=len(controllers)) as pool:
+                    list(pool.map(lambda controller: refresh_controller(*controller), controllers))
+            else:
+                for controller, store_method in controllers:
+                    refresh_controller(controller=controller, store_method=store_method)
+            # notify the chatbot's KB store so the new files are served without waiting for its watcher
+            kb_store.refresh()
             log.info("Knowledge Base Update: Successful.")
 
-            sleep(secs=refresh_rate)
-
         except Exception as e:
             log.error(f"Knowledge Base Update: Unsuccessful. Error: {e}")
 
+        sleep(refresh_rate)
 
-def run_chatbot():
+
+def run_chatbot(kb_store, started):
     try:
         log.info("Instantiating and running NetworkGPT chatbot...")
-        chatbot = Chatbot()
+        chatbot = Chatbot(kb_store=kb_store, started=started)
         chatbot.run()
 
     except Exception as e:
@@ -54,11 +83,21 @@ def run_chatbot():
 
 
 def main():
-    # Asynchronous knowledge base refresh
-    # Thread(target=refresh_knowledge_base).start()
+    started = perf_counter()
+
+    # In-memory knowledge base shared by the refresh thread and the chatbot, served from the persisted KB files
+    kb_store = KnowledgeBaseStore()
+
+    # Deterministic stand-in for the LLM API, for offline runs and benchmarks
+    if LLM_BACKEND == "stub":
+        serve(port=LLM_STUB_PORT, latency=LLM_STUB_LATENCY)
+
+    # Asynchronous knowledge base refresh, a daemon so that stopping the chatbot ends the program
+    if KB_REFRESH_ENABLED:
+        Thread(target=refresh_knowledge_base, args=(kb_store,), daemon=True).start()
 
     # persistent operation of MAMPUlator Webex chatbot
-    run_chatbot()
+    run_chatbot(kb_store=kb_store, started=started)
 
 
 main()